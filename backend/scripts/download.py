@@ -9,163 +9,460 @@ import sys
 import os
 import json
 import time
-import glob
-import re
-import yt_dlp
+import stat
+import atexit
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines - lock is advisory anyway
+    fcntl = None
+
+# Characters not allowed in filenames, stripped via str.translate (no regex engine)
+_FORBIDDEN = str.maketrans('', '', '\\/*?:"<>|')
+
+# Multi-connection segment fetching when aria2c is installed; probed once
+_ARIA2C = shutil.which('aria2c')
+
+# 50MB cap (Telegram bot upload limit downstream)
+_SIZE_LIMIT = 50 * 1024 * 1024
+
+def _size_cap_hook(d):
+    """Abort a download as soon as it is known to exceed the 50MB cap,
+    instead of finishing the transfer and deleting the file afterwards."""
+    known = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+    if known > _SIZE_LIMIT or d.get('downloaded_bytes', 0) > _SIZE_LIMIT:
+        # Drop the partial before aborting - the exception unwinds past
+        # yt-dlp's own cleanup, so the .part file would otherwise stay
+        fname = d.get('tmpfilename') or d.get('filename')
+        if fname:
+            for stale in (fname, fname + '.part'):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        import yt_dlp
+        raise yt_dlp.utils.DownloadError('File exceeds 50MB limit')
+
+def _remove_partials(output_dir: str, unique_base: str):
+    """Best-effort removal of any leftover files for an aborted download."""
+    try:
+        with os.scandir(output_dir) as it:
+            for entry in it:
+                if entry.name.startswith(unique_base):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+    except OSError:
+        pass
+
+# DownloadError classification: first matching needle wins. More specific
+# needles come before looser ones ('Video unavailable' before 'not available').
+_ERR_PATTERNS = (
+    ('50MB', 'File exceeds 50MB limit'),
+    ('Unsupported URL', 'Unsupported URL'),
+    ('Private video', 'Private video'),
+    ('Premiere', 'Cannot download Premieres'),
+    ('429', 'Rate limited by YouTube'),
+    ('Video unavailable', 'Video unavailable'),
+    ('not available', 'Video unavailable'),
+)
+
+# Extensions yt-dlp may produce - include .mp4 as yt-dlp may use it
+_AUDIO_EXTS = frozenset(('.m4a', '.webm', '.opus', '.mp3', '.ogg', '.aac', '.mp4'))
+
+def _find_by_prefix(output_dir: str, unique_base: str):
+    """Locate the downloaded file by its unique prefix via a single scandir pass."""
+    prefix = f"{unique_base}."
+    try:
+        with os.scandir(output_dir) as it:
+            for entry in it:
+                name = entry.name
+                if (name.startswith(prefix)
+                        and os.path.splitext(name)[1].lower() in _AUDIO_EXTS
+                        and entry.is_file()):
+                    return entry.path
+    except OSError:
+        pass
+    return None
+
+def _ensure_dir(output_dir: str):
+    """Ensure output_dir exists; in the steady state this is one stat, no mkdir."""
+    try:
+        if stat.S_ISDIR(os.stat(output_dir).st_mode):
+            return
+    except FileNotFoundError:
+        pass
+    os.makedirs(output_dir, exist_ok=True)
+
+# Per-directory metadata cache: video_id -> result dict from a previous
+# successful download. A cache hit skips yt-dlp (and YouTube) entirely.
+_CACHE_NAME = '.ytcache.json'
+
+def _cache_lookup(output_dir: str, video_id: str):
+    """Return the cached result for video_id if its file is still valid."""
+    try:
+        with open(os.path.join(output_dir, _CACHE_NAME), 'r', encoding='utf-8') as f:
+            entry = json.load(f).get(video_id)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if not entry:
+        return None
+    try:
+        st = os.stat(entry['filePath'])
+    except (OSError, KeyError, TypeError):
+        return None
+    if st.st_size != entry.get('fileSize') or st.st_size > 50 * 1024 * 1024:
+        return None
+    return entry
+
+def _cache_store(output_dir: str, video_id: str, result: dict):
+    """Record a successful download in the per-directory cache (flocked)."""
+    try:
+        with open(os.path.join(output_dir, _CACHE_NAME), 'a+', encoding='utf-8') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                cache = json.load(f)
+            except json.JSONDecodeError:
+                cache = {}
+            cache[video_id] = result
+            f.seek(0)
+            f.truncate()
+            json.dump(cache, f)
+    except OSError:
+        pass  # Cache is best-effort; never fail the download over it
 
 def sanitize_filename(name: str) -> str:
     """Remove or replace characters not allowed in filenames."""
-    return re.sub(r'[\\/*?:"<>|]', '', name)
+    return name.translate(_FORBIDDEN)
+
+# Constant portion of the yt-dlp options, built once; build_ydl_opts overlays
+# only the per-call keys (outtmpl, cookiefile). The nested dicts/lists are
+# shared across instances and never mutated.
+_BASE_YDL_OPTS = {
+    # Download best audio format directly (no FFmpeg conversion needed)
+    'format': 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio[ext=opus]/bestaudio/best',
+    # Completely suppress all console output
+    'quiet': True,
+    'no_warnings': True,
+    'noprogress': True,
+    'logger': None,  # No logging at all
+    'progress_hooks': [_size_cap_hook],  # Abort early when over the size cap
+    # Skip the download outright when the size is known up front
+    'max_filesize': _SIZE_LIMIT,
+    'noplaylist': True,
+    'restrictfilenames': True,
+    # No artificial sleeps between requests: the Node caller serializes
+    # downloads, and 429s are handled by yt-dlp's own retry/backoff
+    # Anti-bot measures - enhanced
+    'geo_bypass': True,
+    'geo_bypass_country': 'US',
+    # Retry options
+    'retries': 5,
+    'fragment_retries': 5,
+    'skip_unavailable_fragments': True,
+    # Modern User Agent (Chrome 120 on Windows)
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-us,en;q=0.5',
+        'Sec-Fetch-Mode': 'navigate',
+    },
+    # YouTube specific options - use multiple clients to bypass bot detection
+    'extractor_args': {
+        'youtube': {
+            # Try multiple player clients - android_embedded and ios often work better
+            'player_client': ['android_music', 'android', 'ios', 'web'],
+            # Skip formats that require login
+            'player_skip': ['webpage', 'configs'],
+            # Audio-only download: skip manifest/subtitle fetches entirely
+            'skip': ['hls', 'dash', 'translated_subs'],
+        }
+    },
+    # Avoid extra network round-trips during extraction - we only need
+    # the progressive audio URL, not probed formats or manifests
+    'check_formats': False,
+    'youtube_include_dash_manifest': False,
+    'youtube_include_hls_manifest': False,
+    # No sidecar data - mostly defaults, pinned so a future config change
+    # can't quietly re-enable the extra fetches
+    'writethumbnail': False,
+    'writedescription': False,
+    'writeannotations': False,
+    'writesubtitles': False,
+    'writeautomaticsub': False,
+    # Additional options to help with bot detection
+    'ignore_no_formats_error': True,  # Try to continue even if some formats fail
+    'socket_timeout': 30,
+}
+
+if _ARIA2C:
+    # Parallel segment fetches saturate bandwidth a single connection
+    # can't; harmless for plain single-file m4a
+    _BASE_YDL_OPTS['external_downloader'] = 'aria2c'
+    _BASE_YDL_OPTS['external_downloader_args'] = {
+        'aria2c': ['-x', '16', '-s', '16', '-k', '1M',
+                   '--console-log-level=error', '--summary-interval=0'],
+    }
+
+def build_ydl_opts(output_template: str = None, cookies_path: str = None) -> dict:
+    """Build the yt-dlp options dict, optionally targeting a specific output template."""
+    ydl_opts = dict(_BASE_YDL_OPTS)
+
+    if output_template:
+        ydl_opts['outtmpl'] = output_template
+
+    # Add cookies if provided (helps bypass 403 errors from datacenter IPs)
+    if cookies_path and os.path.exists(cookies_path):
+        ydl_opts['cookiefile'] = cookies_path
+        print(f"[yt-dlp] Using cookies from: {cookies_path}", file=sys.stderr)
+
+    return ydl_opts
+
+# YoutubeDL instances cached per cookies file so repeated downloads in one
+# process share the urllib opener and its keep-alive pool (no TLS handshake
+# per download). Closed on interpreter exit rather than per call.
+_YDL_CACHE = {}
+
+def _get_cached_ydl(cookies_path: str = None):
+    import yt_dlp
+    ydl = _YDL_CACHE.get(cookies_path)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(build_ydl_opts(cookies_path=cookies_path))
+        _YDL_CACHE[cookies_path] = ydl
+    return ydl
+
+atexit.register(lambda: [y.close() for y in _YDL_CACHE.values()])
+
+def _run_download(ydl, url: str, output_dir: str, unique_base: str) -> dict:
+    """Perform the download on a (possibly shared) YoutubeDL instance."""
+    # Extract info
+    info = ydl.extract_info(url, download=True)
+
+    title = sanitize_filename(info.get('title', 'Unknown Title'))
+    artist = info.get('uploader', 'Unknown Artist')
+    # Only the URL string is needed downstream; take the first entry of the
+    # raw thumbnails list rather than yt-dlp's "best thumbnail" selection
+    thumbnails = info.get('thumbnails')
+    thumbnail_url = (thumbnails[0].get('url') if thumbnails else None) or info.get('thumbnail', '')
+    duration = info.get('duration', 0)
+
+    # yt-dlp reports the final output path itself (post-processing aware),
+    # so ask it instead of scanning the output directory.
+    final_path = (info.get('requested_downloads') or [{}])[0].get('filepath') or ydl.prepare_filename(info)
+
+    # Single stat() serves both the existence check and the 50MB limit
+    try:
+        file_size = os.stat(final_path).st_size
+    except (FileNotFoundError, TypeError):
+        # Fallback: scan for the unique prefix (cached DirEntry data,
+        # no per-file stat beyond the getdents buffer)
+        final_path = _find_by_prefix(output_dir, unique_base)
+        if not final_path:
+            # max_filesize makes yt-dlp skip oversized files before any
+            # progress hook fires; surface that as the size-limit error
+            # instead of a confusing "file not found"
+            rd = (info.get('requested_downloads') or [{}])[0]
+            known_size = (rd.get('filesize') or rd.get('filesize_approx')
+                          or info.get('filesize') or info.get('filesize_approx') or 0)
+            if known_size > _SIZE_LIMIT:
+                return {
+                    'success': False,
+                    'error': f'File exceeds 50MB limit ({known_size / (1024*1024):.2f}MB)'
+                }
+            return {
+                'success': False,
+                'error': f'Download completed but file not found for base: {unique_base}'
+            }
+        file_size = os.stat(final_path).st_size
+
+    # Check file size (50MB limit) - backstop for anything the hook missed
+    if file_size > _SIZE_LIMIT:
+        os.remove(final_path)
+        return {
+            'success': False,
+            'error': f'File exceeds 50MB limit ({file_size / (1024*1024):.2f}MB)'
+        }
+
+    return {
+        'success': True,
+        'filePath': final_path,
+        'title': title,
+        'artist': artist,
+        'thumbnailUrl': thumbnail_url,
+        'duration': duration,
+        'fileSize': file_size
+    }
 
-def download_audio(video_id: str, output_dir: str, cookies_path: str = None) -> dict:
+def download_audio(video_id: str, output_dir: str, cookies_path: str = None, ydl=None) -> dict:
     """
     Download audio from YouTube video.
     Returns JSON with success status, file path, and metadata.
-    
+
     Args:
         video_id: YouTube video ID
         output_dir: Directory to save the downloaded file
         cookies_path: Optional path to cookies.txt file for authentication
+        ydl: Optional pre-built YoutubeDL instance to reuse (worker mode);
+             its output template is retargeted per call
     """
+    # Serve a still-valid previous download without touching YouTube at all
+    cached = _cache_lookup(output_dir, video_id)
+    if cached:
+        return cached
+
+    # Deferred below the cache fast path so hits (and bad-argv fast fails)
+    # never pay the hundreds of milliseconds yt_dlp costs to import;
+    # sys.modules makes repeat imports free
+    import yt_dlp
+
     url = f"https://www.youtube.com/watch?v={video_id}"
-    
-    # Create unique filename with timestamp
-    timestamp = int(time.time() * 1000)
+
+    # Create unique filename with a monotonic timestamp: one clock_gettime,
+    # no float round-trip, and no collisions across wall-clock jumps
+    timestamp = time.monotonic_ns()
     unique_base = f"{video_id}_{timestamp}"
     output_template = os.path.join(output_dir, f"{unique_base}.%(ext)s")
-    
-    ydl_opts = {
-        # Download best audio format directly (no FFmpeg conversion needed)
-        'format': 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio[ext=opus]/bestaudio/best',
-        'outtmpl': output_template,
-        # Completely suppress all console output
-        'quiet': True,
-        'no_warnings': True,
-        'noprogress': True,
-        'logger': None,  # No logging at all
-        'progress_hooks': [],  # No progress callbacks
-        'noplaylist': True,
-        'restrictfilenames': True,
-        # Rate limiting (polite to YouTube)
-        'sleep_interval': 1,
-        'sleep_interval_requests': 1,
-        # Anti-bot measures - enhanced
-        'geo_bypass': True,
-        'geo_bypass_country': 'US',
-        # Retry options
-        'retries': 5,
-        'fragment_retries': 5,
-        'skip_unavailable_fragments': True,
-        # Modern User Agent (Chrome 120 on Windows)
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-us,en;q=0.5',
-            'Sec-Fetch-Mode': 'navigate',
-        },
-        # YouTube specific options - use multiple clients to bypass bot detection
-        'extractor_args': {
-            'youtube': {
-                # Try multiple player clients - android_embedded and ios often work better
-                'player_client': ['android_music', 'android', 'ios', 'web'],
-                # Skip formats that require login
-                'player_skip': ['webpage', 'configs'],
-            }
-        },
-        # Additional options to help with bot detection
-        'ignore_no_formats_error': True,  # Try to continue even if some formats fail
-        'socket_timeout': 30,
-    }
-    
-    # Add cookies if provided (helps bypass 403 errors from datacenter IPs)
-    if cookies_path and os.path.exists(cookies_path):
-        ydl_opts['cookiefile'] = cookies_path
-        print(f"[yt-dlp] Using cookies from: {cookies_path}", file=sys.stderr)
-    
+
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Extract info
-            info = ydl.extract_info(url, download=True)
-            
-            title = sanitize_filename(info.get('title', 'Unknown Title'))
-            artist = info.get('uploader', 'Unknown Artist')
-            thumbnail_url = info.get('thumbnail', '')
-            duration = info.get('duration', 0)
-            
-            # Find the downloaded file - yt-dlp downloads in native format (m4a, webm, opus)
-            # NOT mp3 since we're not using FFmpeg conversion
-            final_path = None
-            pattern = os.path.join(output_dir, f"{unique_base}.*")
-            matches = glob.glob(pattern)
-            
-            # Filter out any partial/temp files - include .mp4 as yt-dlp may use it
-            audio_extensions = ['.m4a', '.webm', '.opus', '.mp3', '.ogg', '.aac', '.mp4']
-            for match in matches:
-                ext = os.path.splitext(match)[1].lower()
-                if ext in audio_extensions and os.path.exists(match):
-                    final_path = match
-                    break
-            
-            if not final_path or not os.path.exists(final_path):
-                # Debug: list what files exist
-                all_matches = glob.glob(pattern)
-                return {
-                    'success': False,
-                    'error': f'Download completed but file not found. Pattern: {pattern}, Matches: {all_matches}'
-                }
+        if ydl is None:
+            ydl = _get_cached_ydl(cookies_path)
+        # Keep the instance (and its HTTP connection pool) alive across
+        # calls, just point it at the new output template
+        ydl.params['outtmpl'] = {'default': output_template}
+        result = _run_download(ydl, url, output_dir, unique_base)
+        if result.get('success'):
+            _cache_store(output_dir, video_id, result)
+        return result
 
-            
-            # Check file size (50MB limit)
-            file_size = os.path.getsize(final_path)
-            if file_size > 50 * 1024 * 1024:
-                os.remove(final_path)
-                return {
-                    'success': False,
-                    'error': f'File exceeds 50MB limit ({file_size / (1024*1024):.2f}MB)'
-                }
-            
-            return {
-                'success': True,
-                'filePath': final_path,
-                'title': title,
-                'artist': artist,
-                'thumbnailUrl': thumbnail_url,
-                'duration': duration,
-                'fileSize': file_size
-            }
-            
     except yt_dlp.utils.DownloadError as de:
         error_msg = str(de)
-        if 'Unsupported URL' in error_msg:
-            return {'success': False, 'error': 'Unsupported URL'}
-        elif 'Video unavailable' in error_msg or 'not available' in error_msg:
-            return {'success': False, 'error': 'Video unavailable'}
-        elif 'Private video' in error_msg:
-            return {'success': False, 'error': 'Private video'}
-        elif 'Premiere' in error_msg:
-            return {'success': False, 'error': 'Cannot download Premieres'}
-        elif '429' in error_msg:
-            return {'success': False, 'error': 'Rate limited by YouTube'}
-        else:
-            return {'success': False, 'error': error_msg[:100]}
+        if '50MB' in error_msg:
+            # Size abort mid-transfer: sweep any partials the hook missed
+            _remove_partials(output_dir, unique_base)
+        for needle, label in _ERR_PATTERNS:
+            if needle in error_msg:
+                return {'success': False, 'error': label}
+        return {'success': False, 'error': error_msg[:100]}
             
     except Exception as e:
         return {'success': False, 'error': str(e)[:100]}
 
+def _emit(result: dict):
+    """Write one compact JSON result line straight to the stdout byte buffer,
+    bypassing the text-mode codec layer."""
+    sys.stdout.buffer.write(json.dumps(result, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    sys.stdout.buffer.write(b'\n')
+    sys.stdout.buffer.flush()
+
+def serve(cookies_path: str = None):
+    """
+    Long-lived worker mode: read one JSON request per stdin line
+    ({"video_id": ..., "output_dir": ...}) and write one JSON result per
+    stdout line. A single YoutubeDL instance (and its connection pool)
+    is shared across all requests, so the interpreter/yt-dlp import cost
+    and per-download TLS handshakes are paid once.
+    """
+    ydl = _get_cached_ydl(cookies_path)
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            req = json.loads(line)
+            output_dir = req['output_dir']
+            _ensure_dir(output_dir)
+            result = download_audio(req['video_id'], output_dir, ydl=ydl)
+        except (json.JSONDecodeError, KeyError) as e:
+            result = {'success': False, 'error': f'Invalid request line: {str(e)[:100]}'}
+        _emit(result)
+
+def run_batch(cookies_path: str = None):
+    """
+    Batch mode: read newline-delimited "video_id<TAB>output_dir" pairs from
+    stdin and emit one JSON result per line. All downloads in the batch share
+    one YoutubeDL instance, amortizing interpreter startup and connection
+    setup across the whole batch.
+    """
+    ydl = _get_cached_ydl(cookies_path)
+    for line in sys.stdin:
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        try:
+            video_id, output_dir = line.split('\t', 1)
+            _ensure_dir(output_dir)
+            result = download_audio(video_id, output_dir, ydl=ydl)
+        except ValueError:
+            result = {'success': False, 'error': f'Invalid batch line (expected video_id<TAB>output_dir): {line[:50]}'}
+        _emit(result)
+
+def _pool_init(cookies_path):
+    # Warm the per-worker YoutubeDL so the first job doesn't pay construction
+    _get_cached_ydl(cookies_path)
+
+def _pool_job(args):
+    video_id, output_dir, cookies_path = args
+    _ensure_dir(output_dir)
+    return download_audio(video_id, output_dir, cookies_path)
+
+def run_pool(workers: int, cookies_path: str = None):
+    """
+    Parallel mode: N pre-warmed worker processes, each holding its own
+    YoutubeDL (and connection pool). Reads video_id<TAB>output_dir pairs
+    from stdin and emits results as they complete, so independent downloads
+    overlap instead of queueing behind one connection.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=workers, initializer=_pool_init,
+                             initargs=(cookies_path,)) as pool:
+        futures = []
+        for line in sys.stdin:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            try:
+                video_id, output_dir = line.split('\t', 1)
+            except ValueError:
+                _emit({'success': False, 'error': f'Invalid pool line (expected video_id<TAB>output_dir): {line[:50]}'})
+                continue
+            futures.append(pool.submit(_pool_job, (video_id, output_dir, cookies_path)))
+        for fut in as_completed(futures):
+            try:
+                _emit(fut.result())
+            except Exception as e:
+                _emit({'success': False, 'error': str(e)[:100]})
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--pool':
+        workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 2
+        run_pool(workers, cookies_path=sys.argv[3] if len(sys.argv) > 3 else None)
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(cookies_path=sys.argv[2] if len(sys.argv) > 2 else None)
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--batch':
+        run_batch(cookies_path=sys.argv[2] if len(sys.argv) > 2 else None)
+        return
+
     if len(sys.argv) < 3:
-        print(json.dumps({'success': False, 'error': 'Usage: download.py <video_id> <output_dir> [cookies_path]'}))
+        _emit({'success': False, 'error': 'Usage: download.py <video_id> <output_dir> [cookies_path] | download.py --serve|--batch [cookies_path] | download.py --pool [N] [cookies_path]'})
         sys.exit(1)
-    
+
     video_id = sys.argv[1]
     output_dir = sys.argv[2]
     cookies_path = sys.argv[3] if len(sys.argv) > 3 else None
-    
+
     # Ensure output directory exists
-    os.makedirs(output_dir, exist_ok=True)
-    
+    _ensure_dir(output_dir)
+
     result = download_audio(video_id, output_dir, cookies_path)
-    print(json.dumps(result))
+    _emit(result)
 
 if __name__ == '__main__':
     main()
@@ -3,18 +3,28 @@ import os
 import logging
 import sys
 import re
+import time
 import json
 import base64
+import functools
+import random
+import string
+import hashlib
+from io import BytesIO
+from urllib.parse import quote as _url_quote
 import pytz
 import signal
 import atexit
+from collections import defaultdict, deque
 from typing import Dict, List, Optional, Tuple, Any, Union
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 from cryptography.fernet import Fernet
 import aiohttp
 import asyncio
+import concurrent.futures
+import threading
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.constants import ParseMode
 from telegram.ext import (
@@ -23,16 +33,27 @@ from telegram.ext import (
 )
 from telegram.error import TimedOut, NetworkError
 import yt_dlp
-from openai import OpenAI
+from openai import AsyncOpenAI
 import importlib
-if importlib.util.find_spec("lyricsgenius") is not None:
-    import lyricsgenius
+# Optional heavyweight deps are detected here but imported on first use -
+# find_spec only reads package metadata, so cold start does not pay for
+# libraries (torch-backed sentence-transformers, lyricsgenius' HTTP stack)
+# that a given session may never touch.
+_HAS_LYRICSGENIUS = importlib.util.find_spec("lyricsgenius") is not None
+if importlib.util.find_spec("bs4") is not None:
+    import bs4
 else:
-    lyricsgenius = None
-if importlib.util.find_spec("async_lru") is not None:
+    bs4 = None
+_HAS_SENTENCE_TRANSFORMERS = importlib.util.find_spec("sentence_transformers") is not None
+_HAS_FASTER_WHISPER = importlib.util.find_spec("faster_whisper") is not None
+# Prefer the mypyc-compiled fork (API-compatible, C-speed cache lookups),
+# fall back to plain async_lru, then to a no-op decorator.
+if importlib.util.find_spec("faster_async_lru") is not None:
+    from faster_async_lru import alru_cache
+elif importlib.util.find_spec("async_lru") is not None:
     from async_lru import alru_cache
 else:
-    def alru_cache(maxsize=128, typed=False): # type: ignore
+    def alru_cache(maxsize=128, typed=False, ttl=None): # type: ignore
         def decorator(func):
             return func
         return decorator
@@ -48,8 +69,29 @@ SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 GENIUS_ACCESS_TOKEN = os.getenv("GENIUS_ACCESS_TOKEN")
 SPOTIFY_REDIRECT_URI = os.getenv("SPOTIFY_REDIRECT_URI", "https://your-callback-url.com") # Must match Spotify Dev Dashboard
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # e.g. https://bot.example.com - enables webhook mode when set
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
 
+# Client-credentials Basic auth header, computed once - the inputs never
+# change after boot, so no per-call b64 pass
+# OAuth URL built once - client id, redirect URI and scopes are fixed after
+# env load; only the per-user state slot varies.
+_SPOTIFY_SCOPES = "user-read-recently-played user-top-read playlist-modify-private"
+_SPOTIFY_AUTH_URL_TEMPLATE = (
+    "https://accounts.spotify.com/authorize"
+    f"?client_id={SPOTIFY_CLIENT_ID}"
+    "&response_type=code"
+    f"&redirect_uri={SPOTIFY_REDIRECT_URI}"
+    f"&scope={_url_quote(_SPOTIFY_SCOPES)}"
+    "&state={user_id}"
+)
+
+_SPOTIFY_BASIC_AUTH = (
+    "Basic " + base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
+    if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET else None
+)
+
 # Enable logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -58,8 +100,22 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Initialize clients
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
-genius = lyricsgenius.Genius(GENIUS_ACCESS_TOKEN, timeout=15, retries=3) if GENIUS_ACCESS_TOKEN and lyricsgenius else None
+client = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+@functools.lru_cache(maxsize=1)
+def _get_genius():
+    """Build the Genius client on first lyrics request (None if unavailable)."""
+    if not (GENIUS_ACCESS_TOKEN and _HAS_LYRICSGENIUS):
+        return None
+    import lyricsgenius
+    import requests.adapters
+    genius = lyricsgenius.Genius(GENIUS_ACCESS_TOKEN, timeout=15, retries=3)
+    # The client keeps one requests.Session for its lifetime (and ours, via
+    # the lru_cache above); widening its connection pool lets consecutive
+    # lyric fetches reuse warm TLS connections instead of re-handshaking.
+    session = getattr(genius, "_session", None)
+    if session is not None:
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=20))
+    return genius
 
 # Encryption Cipher
 if ENCRYPTION_KEY:
@@ -93,40 +149,236 @@ CB_SHOW_OPTIONS_PREFIX = "show_options_"
 CB_CANCEL_SEARCH = "cancel_search"
 CB_CANCEL_SPOTIFY = "cancel_spotify"
 
+# Telegram message length limit (slightly under 4096 for safety)
+_TG_MSG_MAX = 4090
+
+
+# Interned field names for the yt-dlp result-processing loops: interned keys
+# let dict lookups short-circuit on pointer identity instead of hashing and
+# comparing the string every .get() call
+_K_ID = sys.intern("id")
+_K_TITLE = sys.intern("title")
+_K_URL = sys.intern("url")
+_K_WEBPAGE_URL = sys.intern("webpage_url")
+_K_THUMBNAIL = sys.intern("thumbnail")
+_K_THUMBNAILS = sys.intern("thumbnails")
+_K_UPLOADER = sys.intern("uploader")
+_K_DURATION = sys.intern("duration")
+
+# Static UI data built once at import: the recommendation lists, their
+# pre-rendered bodies, and the mood/genre keyboards never change per call.
+_MOOD_RECS = {
+    "happy": ["Uptown Funk - Mark Ronson", "Happy - Pharrell Williams", "Walking on Sunshine - Katrina & The Waves"],
+    "sad": ["Someone Like You - Adele", "Hallelujah - Leonard Cohen (Jeff Buckley version)", "Fix You - Coldplay"],
+    "energetic": ["Don't Stop Me Now - Queen", "Thunderstruck - AC/DC", "Can't Stop the Feeling! - Justin Timberlake"],
+    "relaxed": ["Weightless - Marconi Union", "Clair de Lune - Debussy", "Orinoco Flow - Enya"],
+    "focused": ["The Four Seasons - Vivaldi (Max Richter recomposed)", "Time - Hans Zimmer", "Ambient 1: Music for Airports - Brian Eno"],
+    "nostalgic": ["Bohemian Rhapsody - Queen", "Yesterday - The Beatles", "Wonderwall - Oasis"],
+    "default": ["Three Little Birds - Bob Marley", "Here Comes The Sun - The Beatles", "What a Wonderful World - Louis Armstrong"]
+}
+_MOOD_RECS_BODY = {
+    mood_key: "".join(f"{i}. {track}\n" for i, track in enumerate(tracks, 1))
+    + "\n💡 <i>You can ask me to search or download any of these! (e.g., /autodownload {track example})</i>"
+    for mood_key, tracks in _MOOD_RECS.items()
+}
+
+_MOOD_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Happy 😊", callback_data=f"{CB_MOOD_PREFIX}happy"),
+     InlineKeyboardButton("Sad 😢", callback_data=f"{CB_MOOD_PREFIX}sad")],
+    [InlineKeyboardButton("Energetic 💪", callback_data=f"{CB_MOOD_PREFIX}energetic"),
+     InlineKeyboardButton("Relaxed 😌", callback_data=f"{CB_MOOD_PREFIX}relaxed")],
+    [InlineKeyboardButton("Focused 🧠", callback_data=f"{CB_MOOD_PREFIX}focused"),
+     InlineKeyboardButton("Nostalgic 🕰️", callback_data=f"{CB_MOOD_PREFIX}nostalgic")],
+    [InlineKeyboardButton("Neutral / Other", callback_data=f"{CB_MOOD_PREFIX}neutral")],
+])
+_PREF_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Pop", callback_data=f"{CB_PREFERENCE_PREFIX}pop"),
+     InlineKeyboardButton("Rock", callback_data=f"{CB_PREFERENCE_PREFIX}rock"),
+     InlineKeyboardButton("Hip-Hop", callback_data=f"{CB_PREFERENCE_PREFIX}hiphop")],
+    [InlineKeyboardButton("Electronic", callback_data=f"{CB_PREFERENCE_PREFIX}electronic"),
+     InlineKeyboardButton("Classical", callback_data=f"{CB_PREFERENCE_PREFIX}classical"),
+     InlineKeyboardButton("Jazz", callback_data=f"{CB_PREFERENCE_PREFIX}jazz")],
+    [InlineKeyboardButton("Folk/Acoustic", callback_data=f"{CB_PREFERENCE_PREFIX}folk"),
+     InlineKeyboardButton("R&B/Soul", callback_data=f"{CB_PREFERENCE_PREFIX}rnb"),
+     InlineKeyboardButton("Any/Surprise Me!", callback_data=f"{CB_PREFERENCE_PREFIX}any")],
+    [InlineKeyboardButton("➡️ Skip Genre / Use Mood Only", callback_data=f"{CB_PREFERENCE_PREFIX}skip")],
+])
+
+# Conversation history cap (6 exchanges); deque(maxlen=...) drops the oldest
+# entry on append instead of re-slicing the list every turn
+MAX_HISTORY = 12
 
 # Track active downloads and user contexts
-active_downloads: set[int] = set() # Tracks user_ids with active downloads
-user_contexts: Dict[int, Dict] = {} # In-memory user context store
-logger.warning("User contexts are stored in-memory and will be lost on bot restart. Consider implementing persistence (e.g., pickle, shelve, DB).")
+# Per-user download slots. An asyncio.Lock per user makes the claim atomic
+# even if callbacks interleave, unlike the old check-then-add on a shared set
+# (mashing two download buttons could start duplicate yt-dlp runs).
+_user_dl_locks: Dict[int, asyncio.Lock] = {}
+
+def _download_lock_for(user_id: int) -> asyncio.Lock:
+    if len(_user_dl_locks) > 1024:  # prune idle entries to bound memory
+        for uid in [uid for uid, lck in _user_dl_locks.items() if not lck.locked()]:
+            del _user_dl_locks[uid]
+    return _user_dl_locks.setdefault(user_id, asyncio.Lock())
+def _new_user_context() -> Dict:
+    return {"mood": None, "preferences": [], "conversation_history": deque(maxlen=MAX_HISTORY), "spotify": {}}
+
+# In-memory user context store, snapshotted to disk below. defaultdict means
+# handler entry is a plain index - the default is only built on first sight
+# of a user, not eagerly allocated per message as setdefault required.
+user_contexts: Dict[int, Dict] = defaultdict(_new_user_context)
+# Flat structure-of-arrays view of the hottest context field: mood is read on
+# every inbound message, and a single flat dict lookup beats chasing the
+# two-level user_contexts[uid]["mood"] layout. Mutation sites write through
+# both stores; user_contexts stays authoritative for persistence.
+user_moods: Dict[int, str] = {}
+
+# user_contexts persistence: losing the store on restart forced every
+# returning user back through Spotify OAuth and produced a cold-start burst
+# of token requests. Snapshots are debounced, written atomically, and use
+# orjson when available (stdlib json otherwise).
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# C-level JSON parse when orjson is installed; used for LLM JSON-mode replies
+# and aiohttp response bodies as well as the snapshot file.
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+USER_CONTEXTS_FILE = "user_contexts.json"
+_SNAPSHOT_DEBOUNCE_SECONDS = 5.0
+_snapshot_task: Optional[asyncio.Task] = None
+
+def _context_snapshot_default(obj):
+    """Coerce non-JSON types (encrypted token bytes, history deques) for dumping."""
+    if isinstance(obj, bytes):
+        return {"__bytes__": obj.hex()}
+    if isinstance(obj, (deque, set)):
+        return list(obj)
+    raise TypeError(f"Cannot serialize {type(obj)!r} in user context snapshot")
+
+def _dump_user_contexts() -> None:
+    """Write user_contexts to disk atomically (temp file + rename)."""
+    if orjson is not None:
+        payload = orjson.dumps(user_contexts, default=_context_snapshot_default, option=orjson.OPT_NON_STR_KEYS)
+    else:
+        payload = json.dumps(user_contexts, default=_context_snapshot_default).encode()
+    tmp_path = USER_CONTEXTS_FILE + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, USER_CONTEXTS_FILE)
+
+async def _snapshot_user_contexts() -> None:
+    await asyncio.sleep(_SNAPSHOT_DEBOUNCE_SECONDS)  # coalesce bursts of mutations
+    try:
+        await asyncio.to_thread(_dump_user_contexts)
+    except Exception as e:
+        logger.error(f"Failed to snapshot user contexts: {e}")
+
+def mark_contexts_dirty() -> None:
+    """Schedule a debounced snapshot after a user_contexts mutation."""
+    global _snapshot_task
+    if _snapshot_task is not None and not _snapshot_task.done():
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return  # no loop yet (startup); the atexit flush covers shutdown
+    _snapshot_task = loop.create_task(_snapshot_user_contexts())
+
+def _load_user_contexts() -> None:
+    """Rehydrate user_contexts from the last snapshot, if one exists."""
+    try:
+        with open(USER_CONTEXTS_FILE, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return
+    try:
+        data = _json_loads(raw)
+    except ValueError as e:
+        logger.error(f"Ignoring corrupt user context snapshot: {e}")
+        return
+    for user_id_str, ctx in data.items():
+        ctx["conversation_history"] = deque(ctx.get("conversation_history") or [], maxlen=MAX_HISTORY)
+        spotify_ctx = ctx.get("spotify")
+        if spotify_ctx:  # encrypted tokens round-trip as hex (see _context_snapshot_default)
+            for key in ("access_token", "refresh_token"):
+                value = spotify_ctx.get(key)
+                if isinstance(value, dict) and "__bytes__" in value:
+                    spotify_ctx[key] = bytes.fromhex(value["__bytes__"])
+        user_contexts[int(user_id_str)] = ctx
+        if ctx.get("mood"):
+            user_moods[int(user_id_str)] = ctx["mood"]
+    logger.info(f"Restored {len(user_contexts)} user context(s) from {USER_CONTEXTS_FILE}")
+
+_load_user_contexts()
+atexit.register(_dump_user_contexts)
 DOWNLOAD_DIR = "downloads"
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
 AIOHTTP_TIMEOUT = aiohttp.ClientTimeout(total=20) # Increased default timeout
 
+# Shared pooled HTTP session - keep-alive connections to Spotify/Genius/etc.
+# survive across calls instead of paying a TCP+TLS handshake per request.
+_HTTP_SESSION: Optional[aiohttp.ClientSession] = None
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Return the shared aiohttp session, creating it lazily on first use."""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None or _HTTP_SESSION.closed:
+        _HTTP_SESSION = aiohttp.ClientSession(
+            timeout=AIOHTTP_TIMEOUT,
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=75),
+        )
+    return _HTTP_SESSION
+
+async def close_http_session(application=None) -> None:
+    """Close the shared session on bot shutdown (registered as post_shutdown)."""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is not None and not _HTTP_SESSION.closed:
+        await _HTTP_SESSION.close()
+    _HTTP_SESSION = None
+
 # ==================== SPOTIFY HELPER FUNCTIONS ====================
 
+# Client-credentials token cached until shortly before its 3600s expiry;
+# a plain (token, deadline) tuple keeps the hit path to one clock read.
+_spotify_app_token: Tuple[Optional[str], float] = (None, 0.0)
+
+# Global ceiling on in-flight Spotify calls: under a burst of /recommend
+# traffic, unbounded fan-out stacks hundreds of requests and provokes 429
+# cascades. yt-dlp work is already bounded by its 4-thread executor.
+_SPOTIFY_SEM = asyncio.Semaphore(10)
+
 async def get_spotify_token() -> Optional[str]:
-    """Get Spotify access token using client credentials."""
+    """Get Spotify access token using client credentials. Cached ~55 minutes."""
+    global _spotify_app_token
+    token, expires_at = _spotify_app_token
+    if token and time.monotonic() < expires_at:
+        return token
+    token = await _request_spotify_token()
+    if token:
+        _spotify_app_token = (token, time.monotonic() + 3300) # 300s safety buffer
+    return token
+
+async def _request_spotify_token() -> Optional[str]:
+    """POST to the Spotify token endpoint (uncached)."""
     if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
         logger.warning("Spotify client credentials not configured for client-credentials flow.")
         return None
 
-    auth_string = f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}"
-    auth_bytes = auth_string.encode("utf-8")
-    auth_base64 = str(base64.b64encode(auth_bytes), "utf-8")
-
     url = "https://accounts.spotify.com/api/token"
     headers = {
-        "Authorization": f"Basic {auth_base64}",
+        "Authorization": _SPOTIFY_BASIC_AUTH,
         "Content-Type": "application/x-www-form-urlencoded"
     }
     data = {"grant_type": "client_credentials"}
 
     try:
-        async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
-            async with session.post(url, headers=headers, data=data) as response:
-                response.raise_for_status()
-                return (await response.json()).get("access_token")
+        session = await get_http_session()
+        async with session.post(url, headers=headers, data=data) as response:
+            response.raise_for_status()
+            return (await response.json(loads=_json_loads)).get("access_token")
     except aiohttp.ClientError as e:
         logger.error(f"Error getting Spotify client_credentials token: {e}")
         return None
@@ -134,30 +386,50 @@ async def get_spotify_token() -> Optional[str]:
         logger.error(f"Unexpected error getting Spotify client_credentials token: {e}", exc_info=True)
         return None
 
-@alru_cache(maxsize=100)
-async def search_spotify_track(token: str, query: str) -> Optional[Dict]:
-    """Search for a track on Spotify. Cached."""
-    if not token:
-        return None
-
+@alru_cache(maxsize=512, ttl=3600)
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=4),
+       retry=retry_if_exception_type(aiohttp.ClientError), sleep=asyncio.sleep, reraise=True)
+async def _search_spotify_track_cached(token: str, query: str) -> Optional[Dict]:
+    """Run one Spotify search. Retries transient HTTP errors; only successes cache."""
     url = "https://api.spotify.com/v1/search"
     headers = {"Authorization": f"Bearer {token}"}
     params = {"q": query, "type": "track", "limit": 1}
 
+    session = await get_http_session()
+    async with _SPOTIFY_SEM:
+        async with session.get(url, headers=headers, params=params) as response:
+            response.raise_for_status()
+            items = (await response.json(loads=_json_loads)).get("tracks", {}).get("items", [])
+    if not items:
+        return None
+    # The search endpoint has no server-side fields filter, so project the
+    # only subtree callers read (id/name/uri + artist id/name) before the
+    # result sits in the hour-long cache - the full item drags album art,
+    # markets and preview URLs along for every cached entry.
+    track = items[0]
+    return {
+        "id": track.get("id"),
+        "name": track.get("name"),
+        "uri": track.get("uri"),
+        "artists": [{"id": a.get("id"), "name": a.get("name")}
+                    for a in track.get("artists") or []],
+    }
+
+async def search_spotify_track(token: str, query: str) -> Optional[Dict]:
+    """Search for a track on Spotify. Cached for an hour."""
+    if not token:
+        return None
+
     try:
-        async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                response.raise_for_status()
-                items = (await response.json()).get("tracks", {}).get("items", [])
-                return items[0] if items else None
+        return await _search_spotify_track_cached(token, query)
     except aiohttp.ClientError as e:
-        logger.error(f"Error searching Spotify track '{query}': {e}")
+        logger.error(f"Error searching Spotify track '{query}' after retries: {e}")
         return None
     except Exception as e:
         logger.error(f"Unexpected error searching Spotify track '{query}': {e}", exc_info=True)
         return None
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10), sleep=asyncio.sleep)
 async def get_spotify_recommendations(token: str, seed_tracks: List[str], limit: int = 5, seed_genres: Optional[List[str]] = None, seed_artists: Optional[List[str]] = None) -> List[Dict]:
     """Get track recommendations from Spotify."""
     if not token:
@@ -191,10 +463,11 @@ async def get_spotify_recommendations(token: str, seed_tracks: List[str], limit:
     headers = {"Authorization": f"Bearer {token}"}
 
     try:
-        async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
+        session = await get_http_session()
+        async with _SPOTIFY_SEM:
             async with session.get(url, headers=headers, params=params) as response:
                 response.raise_for_status()
-                return (await response.json()).get("tracks", [])
+                return (await response.json(loads=_json_loads)).get("tracks", [])
     except aiohttp.ClientError as e:
         logger.error(f"Error getting Spotify recommendations (params: {params}): {e}")
         return []
@@ -209,9 +482,8 @@ async def get_user_spotify_token(user_id: int, code: str) -> Optional[Dict]:
         return None
 
     url = "https://accounts.spotify.com/api/token"
-    auth_header = base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
     headers = {
-        "Authorization": f"Basic {auth_header}",
+        "Authorization": _SPOTIFY_BASIC_AUTH,
         "Content-Type": "application/x-www-form-urlencoded"
     }
     data = {
@@ -221,12 +493,12 @@ async def get_user_spotify_token(user_id: int, code: str) -> Optional[Dict]:
     }
 
     try:
-        async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
-            async with session.post(url, headers=headers, data=data) as response:
-                response.raise_for_status()
-                token_data = await response.json()
-                token_data["expires_at"] = (datetime.now(pytz.UTC) + timedelta(seconds=token_data.get("expires_in", 3600) - 60)).timestamp() # -60s buffer
-                return token_data
+        session = await get_http_session()
+        async with session.post(url, headers=headers, data=data) as response:
+            response.raise_for_status()
+            token_data = await response.json(loads=_json_loads)
+            token_data["expires_at"] = time.time() + token_data.get("expires_in", 3600) - 60  # -60s buffer
+            return token_data
     except aiohttp.ClientError as e:
         logger.error(f"Error getting user Spotify token for user {user_id} with code: {e}")
         return None
@@ -234,6 +506,17 @@ async def get_user_spotify_token(user_id: int, code: str) -> Optional[Dict]:
         logger.error(f"Unexpected error getting user Spotify token for user {user_id}: {e}", exc_info=True)
         return None
 
+@functools.lru_cache(maxsize=512)
+def _decrypt_token(ciphertext: bytes) -> str:
+    """Decrypt a stored Spotify token, memoized on the ciphertext.
+
+    Fernet decryption is deterministic, so repeat API calls with the same
+    stored token skip the AES+HMAC round entirely; rotated tokens produce a
+    new ciphertext (new cache key) and old entries age out of the LRU.
+    Decryption failures raise and are never cached.
+    """
+    return cipher.decrypt(ciphertext).decode()
+
 async def refresh_spotify_token(user_id: int) -> Optional[str]:
     """Refresh Spotify access token using refresh token."""
     context = user_contexts.get(user_id, {})
@@ -248,7 +531,7 @@ async def refresh_spotify_token(user_id: int) -> Optional[str]:
         return None
 
     try:
-        refresh_token_str = cipher.decrypt(encrypted_refresh_token_bytes).decode()
+        refresh_token_str = _decrypt_token(encrypted_refresh_token_bytes)
     except Exception as e:
         logger.error(f"Failed to decrypt refresh token for user {user_id}: {e}. Re-authentication required.")
         if "spotify" in user_contexts.get(user_id, {}): # Check if "spotify" key exists before trying to set it.
@@ -258,34 +541,34 @@ async def refresh_spotify_token(user_id: int) -> Optional[str]:
 
 
     url = "https://accounts.spotify.com/api/token"
-    auth_header = base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
     headers = {
-        "Authorization": f"Basic {auth_header}",
+        "Authorization": _SPOTIFY_BASIC_AUTH,
         "Content-Type": "application/x-www-form-urlencoded"
     }
     data = {"grant_type": "refresh_token", "refresh_token": refresh_token_str}
 
     try:
-        async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
-            async with session.post(url, headers=headers, data=data) as response:
-                response.raise_for_status()
-                token_data = await response.json()
-
-                new_access_token = token_data.get("access_token")
-                if not new_access_token:
-                    logger.error(f"Refresh token grant did not return new access_token for user {user_id}")
-                    return None
+        session = await get_http_session()
+        async with session.post(url, headers=headers, data=data) as response:
+            response.raise_for_status()
+            token_data = await response.json(loads=_json_loads)
+
+            new_access_token = token_data.get("access_token")
+            if not new_access_token:
+                logger.error(f"Refresh token grant did not return new access_token for user {user_id}")
+                return None
                 
-                expires_at = (datetime.now(pytz.UTC) + timedelta(seconds=token_data.get("expires_in", 3600) - 60)).timestamp() 
-                new_refresh_token_str = token_data.get("refresh_token", refresh_token_str) # Spotify may issue a new refresh token
-
-                # Ensure structure before assignment
-                user_contexts.setdefault(user_id, {}).setdefault("spotify", {})
-                user_contexts[user_id]["spotify"]["access_token"] = cipher.encrypt(new_access_token.encode())
-                user_contexts[user_id]["spotify"]["refresh_token"] = cipher.encrypt(new_refresh_token_str.encode())
-                user_contexts[user_id]["spotify"]["expires_at"] = expires_at
+            expires_at = time.time() + token_data.get("expires_in", 3600) - 60
+            new_refresh_token_str = token_data.get("refresh_token", refresh_token_str) # Spotify may issue a new refresh token
+
+            # Ensure structure before assignment
+            user_contexts[user_id].setdefault("spotify", {})
+            user_contexts[user_id]["spotify"]["access_token"] = cipher.encrypt(new_access_token.encode())
+            user_contexts[user_id]["spotify"]["refresh_token"] = cipher.encrypt(new_refresh_token_str.encode())
+            mark_contexts_dirty()
+            user_contexts[user_id]["spotify"]["expires_at"] = expires_at
                 
-                return new_access_token
+            return new_access_token
     except aiohttp.ClientError as e:
         logger.error(f"Error refreshing Spotify token for user {user_id}: {e}")
         if hasattr(e, 'status') and e.status == 400: # HTTP 400 can mean 'invalid_grant' (e.g. revoked token)
@@ -305,12 +588,12 @@ async def get_user_spotify_access_token(user_id: int) -> Optional[str]:
     expires_at = spotify_data.get("expires_at")
 
     if not encrypted_access_token_bytes or \
-       (expires_at and datetime.now(pytz.UTC).timestamp() > expires_at):
+       (expires_at and time.time() > expires_at):
         logger.info(f"Access token for user {user_id} is missing or expired, attempting refresh.")
         return await refresh_spotify_token(user_id)
     
     try:
-        return cipher.decrypt(encrypted_access_token_bytes).decode()
+        return _decrypt_token(encrypted_access_token_bytes)
     except Exception as e:
         logger.error(f"Failed to decrypt access token for user {user_id}: {e}. Attempting refresh.")
         return await refresh_spotify_token(user_id)
@@ -328,10 +611,11 @@ async def get_user_spotify_data(user_id: int, endpoint: str, params: Optional[Di
     request_params: Dict[str, Any] = {"limit": 10, **(params or {})} 
 
     try:
-        async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
+        session = await get_http_session()
+        async with _SPOTIFY_SEM:
             async with session.get(url, headers=headers, params=request_params) as response:
                 response.raise_for_status()
-                return (await response.json()).get("items", [])
+                return (await response.json(loads=_json_loads)).get("items", [])
     except aiohttp.ClientError as e:
         logger.error(f"Error fetching Spotify user data ('{endpoint}') for user {user_id}: {e}")
         if hasattr(e, 'status') and e.status == 401: 
@@ -343,35 +627,57 @@ async def get_user_spotify_data(user_id: int, endpoint: str, params: Optional[Di
 
 # ==================== YOUTUBE HELPER FUNCTIONS ====================
 
+# Compiled once at import: these fire on every user URL/download, and a
+# module-level compile skips the re-cache hash/lookup per call.
+# Matches various YouTube URL formats including shorts
+_YT_URL_RE = re.compile(r"(?:https?:\/\/)?(?:www\.)?(?:youtube\.com\/(?:watch\?v=|embed\/|v\/|shorts\/)|youtu\.be\/)([a-zA-Z0-9_-]{11})")
+_YT_ID_RE = re.compile(r'(?:v=|/)([0-9A-Za-z_-]{11})')
+_YT_ID_EXACT_RE = re.compile(r'^[0-9A-Za-z_-]{11}$')  # callback-data validation
+_YT_TEMP_RE = re.compile(r"^[a-zA-Z0-9_-]{11}_\d{14}\..+")  # videoID_timestamp.ext temp files
+_TEMP_AUDIO_EXTS = (".m4a", ".mp3", ".webm", ".ogg", ".opus", ".aac")
+# Heuristic lyrics-request prefixes as one alternation instead of a Python
+# loop over startswith checks per message
+_LYRICS_PREFIX_RE = re.compile(
+    r'^(?:(?:get |find |song )?lyrics (?:for|to)|what are the lyrics to)\s+(.+)$',
+    re.IGNORECASE | re.DOTALL)
+# Single-character substitution: a maketrans table beats the regex engine here
+_FILENAME_TRANS = str.maketrans({c: "_" for c in '\\/*?:"<>|'})
+# ASCII-only lowercase table for cache-key normalization: translate avoids
+# the Unicode-aware .lower() machinery on the (dominant) ASCII traffic, and
+# leaving non-ASCII letters untouched only costs a rare cache miss.
+_LOWER_TABLE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+@functools.lru_cache(maxsize=2048)
 def is_valid_youtube_url(url: str) -> bool:
-    """Check if the URL is a valid YouTube URL."""
-    if not url:
-        return False
-    # Regex to match various YouTube URL formats including shorts
-    patterns = [
-        r"(?:https?:\/\/)?(?:www\.)?(?:youtube\.com\/(?:watch\?v=|embed\/|v\/|shorts\/)|youtu\.be\/)([a-zA-Z0-9_-]{11})"
-    ]
-    return any(re.search(pattern, url) for pattern in patterns)
+    """Check if the URL is a valid YouTube URL.
+
+    Memoized: the same URL passes through several handlers on button-driven
+    flows, so repeat checks become dict hits instead of regex scans.
+    """
+    return bool(url) and _YT_URL_RE.search(url) is not None
 
 def sanitize_filename(filename: str) -> str:
     """Remove invalid characters from filenames for display or metadata."""
-    sanitized = re.sub(r'[\\/*?:"<>|]', "_", filename)
-    return sanitized[:100] # Truncate to a reasonable length
+    return filename.translate(_FILENAME_TRANS)[:100] # Truncate to a reasonable length
 
 @retry(stop=stop_after_attempt(2), wait=wait_exponential(multiplier=1, min=2, max=5))
 def download_youtube_audio_sync(url: str) -> Dict[str, Any]: 
     """Download audio from a YouTube video. This is a BLOCKING function."""
     logger.info(f"Attempting to download audio from: {url}")
     
-    video_id_match = re.search(r'(?:v=|/)([0-9A-Za-z_-]{11})', url)
+    video_id_match = _YT_ID_RE.search(url)
     video_id = video_id_match.group(1) if video_id_match else "UnknownID"
     unique_filename_base = f"{video_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
 
 
     try:
+        # Prefer the m4a audio stream (YouTube's itag 140) but keep %(ext)s in
+        # the template: when m4a is absent the fallback branches deliver
+        # webm/opus, and pinning .m4a would mislabel those containers. The
+        # real path comes from requested_downloads/prepare_filename below.
         ydl_opts = {
             'format': 'bestaudio[ext=m4a]/bestaudio/best', 
-            'outtmpl': os.path.join(DOWNLOAD_DIR, f'{unique_filename_base}.%(ext)s'), # Unique temp name
+            'outtmpl': os.path.join(DOWNLOAD_DIR, f'{unique_filename_base}.%(ext)s'),
             'quiet': True,
             'no_warnings': True,
             'noplaylist': True,
@@ -383,35 +689,30 @@ def download_youtube_audio_sync(url: str) -> Dict[str, Any]:
         }
         final_audio_path = None
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False) 
-            if not info:
+            # One download=True call returns the same metadata dict the old
+            # download=False precheck fetched - no second round-trip to YouTube
+            download_info = ydl.extract_info(url, download=True)
+            if not download_info:
                 logger.error(f"Could not extract video information for {url} (ID: {video_id})")
                 return {"success": False, "error": "Could not extract video information"}
+            info = download_info
 
             # Use title and artist from metadata for display, but unique_filename_base for actual file
-            display_title = sanitize_filename(info.get('title', 'Unknown Title'))
-            artist = sanitize_filename(info.get('artist', info.get('uploader', 'Unknown Artist')))
-            
-            # This will download to a filename like 'VideoID_Timestamp.m4a' (or other extension)
-            logger.info(f"Downloading '{display_title}' by '{artist}' (ID: {video_id})")
-            download_info = ydl.extract_info(url, download=True) # This will perform the download
-            
-            # Find the actual downloaded file path from 'requested_downloads' or by listing dir for unique_filename_base.*
+            display_title = sanitize_filename(info.get(_K_TITLE, 'Unknown Title'))
+            artist = sanitize_filename(info.get('artist', info.get(_K_UPLOADER, 'Unknown Artist')))
+            logger.info(f"Downloaded '{display_title}' by '{artist}' (ID: {video_id})")
+
+            # Find the actual downloaded file path from 'requested_downloads', falling back to prepare_filename.
             # yt-dlp >= 2023.06.22 should populate 'filepath' in 'requested_downloads' correctly.
             # For older versions or fallback:
             if download_info and 'requested_downloads' in download_info and download_info['requested_downloads']:
                  final_audio_path = download_info['requested_downloads'][0].get('filepath')
 
-            if not final_audio_path or not os.path.exists(final_audio_path):
-                # Fallback: Search for file starting with unique_filename_base in DOWNLOAD_DIR
-                for f_name in os.listdir(DOWNLOAD_DIR):
-                    if f_name.startswith(unique_filename_base):
-                        final_audio_path = os.path.join(DOWNLOAD_DIR, f_name)
-                        logger.info(f"File found by fallback search: {final_audio_path}")
-                        break
-                if not final_audio_path or not os.path.exists(final_audio_path):
-                    logger.error(f"Downloaded file not found for base '{unique_filename_base}' from {url}")
-                    return {"success": False, "error": "Downloaded file not found after download process."}
+            if not final_audio_path:
+                final_audio_path = ydl.prepare_filename(info)
+            if not os.path.exists(final_audio_path):
+                logger.error(f"Downloaded file not found at '{final_audio_path}' for {url}")
+                return {"success": False, "error": "Downloaded file not found after download process."}
             
             file_size_mb = os.path.getsize(final_audio_path) / (1024 * 1024)
             if file_size_mb > 50.5: # Small buffer for Telegram's 50MB limit
@@ -419,14 +720,14 @@ def download_youtube_audio_sync(url: str) -> Dict[str, Any]:
                 logger.warning(f"File '{display_title}' exceeded 50MB limit ({file_size_mb:.2f}MB), removing: {final_audio_path}")
                 return {"success": False, "error": "File exceeds 50 MB Telegram limit after download"}
             
-            thumbnail_url = info.get('thumbnail') 
+            thumbnail_url = info.get(_K_THUMBNAIL) 
 
             return {
                 "success": True,
                 "title": display_title,
                 "artist": artist,
                 "thumbnail_url": thumbnail_url, 
-                "duration": info.get('duration', 0),
+                "duration": info.get(_K_DURATION, 0),
                 "audio_path": final_audio_path # This is the actual path
             }
     except yt_dlp.utils.DownloadError as de:
@@ -443,7 +744,50 @@ def download_youtube_audio_sync(url: str) -> Dict[str, Any]:
         logger.error(f"Generic error downloading YouTube audio {url} (ID: {video_id}): {e}", exc_info=True)
         return {"success": False, "error": f"An unexpected error occurred: {str(e)[:100]}"}
 
-def search_youtube_sync(query: str, max_results: int = 5) -> List[Dict]: 
+# Reusable metadata-only YoutubeDL instances, one per executor thread:
+# constructing one per title prefetch re-parses options and reloads extractors
+# every call, but YoutubeDL is not safe to share across threads, so each
+# _YTDL_EXECUTOR worker lazily builds its own. extract_flat skips format
+# probing since only the title is wanted.
+_YTDL_META_LOCAL = threading.local()
+
+def _ytdl_meta() -> yt_dlp.YoutubeDL:
+    ydl = getattr(_YTDL_META_LOCAL, 'ydl', None)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True,
+                                'skip_download': True, 'extract_flat': 'in_playlist'})
+        _YTDL_META_LOCAL.ydl = ydl
+    return ydl
+
+# Dedicated executor for blocking yt_dlp work. Keeping these heavy calls off
+# the default asyncio.to_thread pool stops a burst of downloads from stalling
+# every other to_thread user (OpenAI, Genius, speech recognition).
+_YTDL_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="ytdl")
+
+async def download_youtube_audio(url: str) -> Dict[str, Any]:
+    """Async wrapper running download_youtube_audio_sync on the yt-dlp executor."""
+    return await asyncio.get_running_loop().run_in_executor(_YTDL_EXECUTOR, download_youtube_audio_sync, url)
+
+@alru_cache(maxsize=2048, ttl=1800)
+async def _search_youtube_cached(query: str, max_results: int) -> List[Dict]:
+    return await asyncio.get_running_loop().run_in_executor(_YTDL_EXECUTOR, search_youtube_sync, query, max_results)
+
+async def search_youtube(query: str, max_results: int = 5) -> List[Dict]:
+    """Search YouTube, memoized for 30 minutes on the normalized query.
+
+    Popular queries from different users collapse onto one cached result, and
+    alru_cache's shared in-flight future dedupes concurrent misses.
+    """
+    return await _search_youtube_cached(query.strip().translate(_LOWER_TABLE), max_results)
+
+@alru_cache(maxsize=1024, ttl=1800)
+async def _prefetch_title(url: str) -> Optional[str]:
+    """Metadata-only title lookup, memoized alongside the search cache."""
+    info = await asyncio.get_running_loop().run_in_executor(
+        _YTDL_EXECUTOR, lambda: _ytdl_meta().extract_info(url, download=False))
+    return info.get('title') if info else None
+
+def search_youtube_sync(query: str, max_results: int = 5) -> List[Dict]:
     """Search YouTube for videos matching the query. This is a BLOCKING function."""
     logger.info(f"Searching YouTube for: '{query}' with max_results={max_results}")
     try:
@@ -467,18 +811,18 @@ def search_youtube_sync(query: str, max_results: int = 5) -> List[Dict]:
             for entry in info['entries']:
                 if not entry: continue # Skip empty entries
                 # Ensure basic validity of an entry as a video result
-                video_id = entry.get('id')
-                if not video_id or not entry.get('title') or not (entry.get('webpage_url') or entry.get('url')):
-                    logger.debug(f"Skipping malformed search entry for '{query}': {entry.get('title', 'No Title')}")
+                video_id = entry.get(_K_ID)
+                if not video_id or not entry.get(_K_TITLE) or not (entry.get(_K_WEBPAGE_URL) or entry.get(_K_URL)):
+                    logger.debug("Skipping malformed search entry for '%s': %s", query, entry.get(_K_TITLE, "No Title"))
                     continue
                 
                 results.append({
-                    'title': entry.get('title', 'Unknown Title'),
-                    'url': entry.get('webpage_url') or entry.get('url') or f"https://www.youtube.com/watch?v={video_id}",
-                    'thumbnail': entry.get('thumbnail') or (entry.get('thumbnails')[0]['url'] if entry.get('thumbnails') else None),
-                    'uploader': entry.get('uploader', 'Unknown Artist'),
-                    'duration': entry.get('duration', 0),
-                    'id': video_id 
+                    _K_TITLE: entry.get(_K_TITLE, 'Unknown Title'),
+                    _K_URL: entry.get(_K_WEBPAGE_URL) or entry.get(_K_URL) or f"https://www.youtube.com/watch?v={video_id}",
+                    _K_THUMBNAIL: entry.get(_K_THUMBNAIL) or (entry.get(_K_THUMBNAILS)[0][_K_URL] if entry.get(_K_THUMBNAILS) else None),
+                    _K_UPLOADER: entry.get(_K_UPLOADER, 'Unknown Artist'),
+                    _K_DURATION: entry.get(_K_DURATION, 0),
+                    _K_ID: video_id 
                 })
             logger.info(f"Found {len(results)} results for '{query}'")
             return results
@@ -492,16 +836,26 @@ def search_youtube_sync(query: str, max_results: int = 5) -> List[Dict]:
 
 # ==================== AI AND LYRICS FUNCTIONS ====================
 
+def _summarize_recent_artists(recently_played: List[Dict]) -> str:
+    """Build the 'recently listened' artist line once per Spotify refresh."""
+    try:
+        artists = dict.fromkeys(
+            item["track"]["artists"][0]["name"]
+            for item in recently_played[:3]
+            if item.get("track") and item["track"].get("artists")
+        )
+    except (KeyError, IndexError, TypeError):
+        return ""
+    return ", ".join(artists)
+
 async def generate_chat_response(user_id: int, message: str) -> str:
     """Generate a conversational response using OpenAI."""
     if not client:
         return "I'm having trouble connecting to my AI service. Please try again later."
 
-    user_contexts.setdefault(user_id, {"mood": None, "preferences": [], "conversation_history": [], "spotify": {}})
+    user_contexts[user_id]  # defaultdict: allocates only on first sight
     context = user_contexts[user_id]
-    context.setdefault("conversation_history", []) 
-
-    context["conversation_history"] = context["conversation_history"][-12:]  # Last 6 exchanges for context
+    context.setdefault("conversation_history", deque(maxlen=MAX_HISTORY)) # Self-truncating ring buffer
 
     system_prompt = (
         "You are MelodyMind, a friendly, empathetic music companion bot. Focus on brief (1-3 sentences), warm, natural conversation about music and feelings. "
@@ -518,13 +872,12 @@ async def generate_chat_response(user_id: int, message: str) -> str:
         context_summary_parts.append(f"User's preferred genres: {', '.join(context.get('preferences'))}.")
     
     if "spotify" in context and context["spotify"].get("recently_played"):
-        try:
-            artists = list(set(item["track"]["artists"][0]["name"] for item in context["spotify"]["recently_played"][:3] if item.get("track") and item["track"].get("artists")))
-            if artists:
-                context_summary_parts.append(f"User recently listened to artists like: {', '.join(artists)}.")
-        except Exception: 
-            pass # Silent fail on parsing Spotify data for summary
-            
+        spotify_ctx = context["spotify"]
+        if "_artist_summary" not in spotify_ctx:
+            spotify_ctx["_artist_summary"] = _summarize_recent_artists(spotify_ctx["recently_played"])
+        if spotify_ctx["_artist_summary"]:
+            context_summary_parts.append(f"User recently listened to artists like: {spotify_ctx['_artist_summary']}.")
+
     if context_summary_parts:
         messages.append({"role": "system", "content": "Relevant User Info: " + " ".join(context_summary_parts)})
 
@@ -533,25 +886,49 @@ async def generate_chat_response(user_id: int, message: str) -> str:
     messages.append({"role": "user", "content": message})
 
     try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
+        response = await client.chat.completions.create(
             model="gpt-4-turbo",
             messages=messages,
             max_tokens=150, # Increased from 100
             temperature=0.75
         )
         reply = response.choices[0].message.content.strip()
-        context["conversation_history"].extend([
-            {"role": "user", "content": message},
-            {"role": "assistant", "content": reply}
-        ])
+        context["conversation_history"].append({"role": "user", "content": message})
+        context["conversation_history"].append({"role": "assistant", "content": reply})
+        context["_summary_dirty"] = True
+        mark_contexts_dirty()
         return reply
     except Exception as e:
         logger.error(f"Error generating chat response for user {user_id}: {e}")
         return "I'm having a little trouble thinking of a reply right now. Maybe we can talk about your favorite song instead?"
 
-def get_lyrics_sync(song_title: str, artist: Optional[str] = None) -> str: 
-    """Get lyrics for a song using Genius API. This is a BLOCKING function."""
+# Lyrics cleanup patterns, compiled once. Section headers and general
+# metadata tags are separate passes because they substitute differently
+# (deletion vs. newline).
+_LYR_SECTION_RE = re.compile(r'^\s*\[(Verse|Chorus|Bridge|Intro|Outro|Pre-Chorus|Hook|Instrumental|Guitar Solo)[^\]]*\]\s*$', re.MULTILINE | re.IGNORECASE)
+_LYR_TAG_RE = re.compile(r'\s*\[.*?\]\s*')
+_LYR_EMBED_RE = re.compile(r'\d*Embed$')
+_LYR_PREFIX_RE = re.compile(r'^\S*Lyrics', re.IGNORECASE)
+_LYR_NL_RE = re.compile(r'\n{3,}')
+
+def _clean_genius_lyrics(lyrics: str) -> str:
+    """Strip Genius markup/markers from raw lyrics text."""
+    # Pre-process to remove instrumental/intro/outro markers on their own lines, etc.
+    lyrics = _LYR_SECTION_RE.sub('', lyrics)
+    lyrics = _LYR_TAG_RE.sub('\n', lyrics)  # General metadata tags replaced by newline
+    lyrics = _LYR_EMBED_RE.sub('', lyrics.strip())
+    lyrics = _LYR_PREFIX_RE.sub('', lyrics.strip()) # Remove "SongTitleLyrics"
+    lyrics = _LYR_NL_RE.sub('\n\n', lyrics) # Reduce multiple newlines to double
+    return lyrics.strip()
+
+def _lyrics_not_found_message(song_title: str, artist: Optional[str]) -> str:
+    err_msg = f"Sorry, I couldn't find lyrics for '<b>{song_title}</b>'"
+    if artist: err_msg += f" by <i>{artist}</i>"
+    return err_msg + ". Please check the spelling or try another song!"
+
+def get_lyrics_sync(song_title: str, artist: Optional[str] = None) -> str:
+    """Get lyrics for a song using the lyricsgenius client. This is a BLOCKING function."""
+    genius = _get_genius()
     if not genius:
         return "Lyrics service is currently unavailable."
     logger.info(f"Fetching lyrics for song: '{song_title}' by artist: '{artist or 'Any'}'")
@@ -563,20 +940,10 @@ def get_lyrics_sync(song_title: str, artist: Optional[str] = None) -> str:
             song = genius.search_song(song_title)
             
         if not song:
-            err_msg = f"Sorry, I couldn't find lyrics for '<b>{song_title}</b>'"
-            if artist: err_msg += f" by <i>{artist}</i>"
-            err_msg += ". Please check the spelling or try another song!"
             logger.warning(f"No lyrics found for '{song_title}' by '{artist or 'Any'}'")
-            return err_msg
+            return _lyrics_not_found_message(song_title, artist)
         
-        lyrics = song.lyrics
-        # Pre-process to remove instrumental/intro/outro markers on their own lines, etc.
-        lyrics = re.sub(r'^\s*\[(Verse|Chorus|Bridge|Intro|Outro|Pre-Chorus|Hook|Instrumental|Guitar Solo)[^\]]*\]\s*$', '', lyrics, flags=re.MULTILINE | re.IGNORECASE)
-        lyrics = re.sub(r'\s*\[.*?\]\s*', '\n', lyrics)  # General metadata tags replaced by newline
-        lyrics = re.sub(r'\d*Embed$', '', lyrics.strip()) 
-        lyrics = re.sub(r'^\S*Lyrics', '', lyrics.strip(), flags=re.IGNORECASE) # Remove "SongTitleLyrics"
-        lyrics = re.sub(r'\n{3,}', '\n\n', lyrics) # Reduce multiple newlines to double
-        lyrics = lyrics.strip()
+        lyrics = _clean_genius_lyrics(song.lyrics)
 
         if not lyrics: 
             logger.warning(f"Lyrics found for '{song.title}' but were empty after cleaning.")
@@ -588,122 +955,394 @@ def get_lyrics_sync(song_title: str, artist: Optional[str] = None) -> str:
         logger.error(f"Error fetching lyrics for '{song_title}' from Genius: {e}", exc_info=True)
         return f"I encountered an issue trying to fetch lyrics for '<b>{song_title}</b>'. Please try again later."
 
+async def _scrape_genius_lyrics(song_url: str) -> str:
+    """Fetch a Genius lyric page over the shared session and extract its text."""
+    session = await get_http_session()
+    async with session.get(song_url, headers={"User-Agent": "Mozilla/5.0"}) as resp:
+        resp.raise_for_status()
+        html = await resp.text()
+    # Parsing is CPU-bound but only a few ms; the slow part (network) is async.
+    soup = bs4.BeautifulSoup(html, "html.parser")
+    containers = soup.select('div[data-lyrics-container="true"]')
+    for container in containers:
+        for br in container.find_all("br"):
+            br.replace_with("\n")
+    return "\n".join(c.get_text() for c in containers)
+
+async def _get_lyrics_via_api(song_title: str, artist: Optional[str]) -> Optional[str]:
+    """Genius REST search + page scrape on the event loop. None on failure."""
+    session = await get_http_session()
+    params = {"q": f"{song_title} {artist}" if artist else song_title}
+    headers = {"Authorization": f"Bearer {GENIUS_ACCESS_TOKEN}"}
+    async with session.get("https://api.genius.com/search", params=params, headers=headers) as resp:
+        resp.raise_for_status()
+        hits = (await resp.json()).get("response", {}).get("hits", [])
+
+    hit = None
+    if artist:
+        artist_lower = artist.lower()
+        for candidate in hits:
+            if artist_lower in candidate["result"]["primary_artist"]["name"].lower():
+                hit = candidate
+                break
+    if hit is None and hits:
+        hit = hits[0]
+    if hit is None:
+        return None
 
-async def detect_mood_from_text(user_id: int, text: str) -> str:
-    """Detect mood from user's message using AI."""
-    if not client:
-        return user_contexts.get(user_id, {}).get("mood", "neutral") # Return current mood or neutral
-    logger.debug(f"Detecting mood from text for user {user_id}: '{text[:50]}...'")
-    try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-3.5-turbo",
-            messages=[{"role": "system", "content": "You are a mood detection AI. Analyze text and return a single dominant mood (happy, sad, anxious, excited, calm, angry, energetic, relaxed, focused, nostalgic, or neutral if unclear). Respond with only the mood word."},
-                      {"role": "user", "content": f"Text: '{text}'"}],
-            max_tokens=10, 
-            temperature=0.2
-        )
-        mood_raw = response.choices[0].message.content.lower().strip().replace(".", "")
-        mood_map = { # Simple normalization
-            "positive": "happy", "negative": "sad", "joyful": "happy", "depressed": "sad",
-            "chill": "relaxed", "stressed": "anxious", "hyper": "energetic", "peaceful": "calm"
-        }
-        mood = mood_map.get(mood_raw, mood_raw)
-        
-        valid_moods = ["happy", "sad", "anxious", "excited", "calm", "angry", "neutral", "energetic", "relaxed", "focused", "nostalgic"]
-        if mood in valid_moods:
-            logger.info(f"Detected mood for user {user_id}: '{mood}' (from raw: '{mood_raw}')")
-            return mood
-        else: 
-            logger.warning(f"Unexpected mood from AI: '{mood_raw}' for text '{text}'. Defaulting to neutral.")
-            return "neutral"
+    result = hit["result"]
+    found_title = result.get("title", song_title)
+    found_artist = result.get("primary_artist", {}).get("name", artist or "Unknown")
+    lyrics = _clean_genius_lyrics(await _scrape_genius_lyrics(result["url"]))
+    if not lyrics:
+        return None
+    return f"🎵 <b>{found_title}</b> by <i>{found_artist}</i> 🎵\n\n" + lyrics
 
-    except Exception as e:
-        logger.error(f"Error detecting mood for user {user_id}: {e}")
-        return user_contexts.get(user_id, {}).get("mood", "neutral") # Fallback
+async def _get_lyrics_via_client(song_title: str, artist: Optional[str]) -> Optional[str]:
+    """lyricsgenius client in a thread. None unless it produced real lyrics."""
+    if not _HAS_LYRICSGENIUS:
+        return None
+    text = await asyncio.to_thread(get_lyrics_sync, song_title, artist)
+    # The sync helper reports failures as user-facing sentences; only a
+    # formatted lyrics body counts as a win for the race.
+    return text if text.startswith("🎵") else None
 
+_LYRICS_PROVIDER_TIMEOUT = 8.0
 
-async def is_music_request(user_id: int, message: str) -> Dict:
-    """Use AI to determine if a message is a music/song request and extract query."""
-    if not client:
-        return {"is_music_request": False, "song_query": None}
+async def get_lyrics(song_title: str, artist: Optional[str] = None) -> str:
+    """Fetch lyrics, racing the REST scraper against the lyricsgenius client.
 
-    logger.debug(f"AI: Checking if '{message[:50]}...' is music request for user {user_id}")
-    try:
-        prompt_messages = [
-            {"role": "system", "content": 
-                "You are an AI that analyzes user messages for specific music requests. "
-                "Respond in JSON with 'is_music_request' (boolean) and 'song_query' (string containing song title/artist, or null). "
-                "Focus on explicit requests like 'play X by Y', 'download Z', 'find song A'. General music chat or mood expression is NOT a specific song request unless they name something specific they want *now*. If they ask 'can you play X?', that is a request."
-            },
-            {"role": "user", "content": f"Analyze message: '{message}'"}
-        ]
-        
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-3.5-turbo-0125", # Good model for JSON mode
-            messages=prompt_messages,
-            max_tokens=80,
-            temperature=0.05, # Low temperature for factual extraction
-            response_format={"type": "json_object"}
-        )
+    Both providers start together; the first real result wins and the loser
+    is cancelled, so p50 tracks the faster source and a hung provider is
+    bounded by the per-source timeout instead of stacking RTTs.
+    """
+    if not GENIUS_ACCESS_TOKEN:
+        return "Lyrics service is currently unavailable."
+    logger.info(f"Fetching lyrics for song: '{song_title}' by artist: '{artist or 'Any'}'")
 
-        result_str = response.choices[0].message.content
-        result = json.loads(result_str)
+    providers = []
+    if bs4 is not None:
+        providers.append(_get_lyrics_via_api(song_title, artist))
+    providers.append(_get_lyrics_via_client(song_title, artist))
 
-        if not isinstance(result, dict): 
-            logger.error(f"AI music request (user {user_id}) returned non-dict: {result_str}")
-            return {"is_music_request": False, "song_query": None}
+    tasks = {asyncio.create_task(asyncio.wait_for(p, _LYRICS_PROVIDER_TIMEOUT)) for p in providers}
+    try:
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    lyrics = task.result()
+                except Exception as e:
+                    logger.warning(f"Lyrics provider failed for '{song_title}': {e}")
+                    continue
+                if lyrics:
+                    return lyrics
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    logger.warning(f"No lyrics found for '{song_title}' by '{artist or 'Any'}'")
+    return _lyrics_not_found_message(song_title, artist)
+
+
+# Mood detection is LLM-bound (seconds per call) while inputs repeat a lot
+# ("i'm sad", "chill vibes"), so results are cached content-addressed for an
+# hour. The model name and system prompt are folded into the key, so editing
+# either invalidates old entries automatically.
+_MOOD_MAP = { # Simple normalization of common off-list answers (interned values)
+    "positive": sys.intern("happy"), "negative": sys.intern("sad"),
+    "joyful": sys.intern("happy"), "depressed": sys.intern("sad"),
+    "chill": sys.intern("relaxed"), "stressed": sys.intern("anxious"),
+    "hyper": sys.intern("energetic"), "peaceful": sys.intern("calm")
+}
+# Tuple for stable label order (the local classifier indexes into it),
+# frozenset for O(1) membership on the per-message path.
+_VALID_MOODS = tuple(sys.intern(m) for m in (
+    "happy", "sad", "anxious", "excited", "calm", "angry", "neutral",
+    "energetic", "relaxed", "focused", "nostalgic"))
+_VALID_MOOD_SET = frozenset(_VALID_MOODS)
+# Trailing periods/whitespace stripped in one C-level pass
+_MOOD_NOISE_RE = re.compile(r"[.\s]+$")
+
+# Classification workloads (mood/intent) run on a cheaper, lower-TTFT model;
+# the richer chat replies keep their own model choice.
+FAST_MODEL = os.getenv("FAST_MODEL", "gpt-4o-mini")
+
+_MOOD_MODEL = FAST_MODEL
+_MOOD_SYSTEM_PROMPT = "You are a mood detection AI. Analyze text and return a single dominant mood (happy, sad, anxious, excited, calm, angry, energetic, relaxed, focused, nostalgic, or neutral if unclear). Respond with only the mood word."
+_MOOD_PROMPT_DIGEST = hashlib.sha256(f"{_MOOD_MODEL}\x00{_MOOD_SYSTEM_PROMPT}".encode()).digest()
+_MOOD_CACHE_TTL = 3600
+_MOOD_CACHE_MAX = 2000
+_mood_cache: Dict[bytes, Tuple[str, float]] = {}
+
+def _mood_cache_key(text: str) -> bytes:
+    return hashlib.sha256(_MOOD_PROMPT_DIGEST + text.translate(_LOWER_TABLE).strip().encode()).digest()
+
+def _mood_cache_get(key: bytes) -> Optional[str]:
+    entry = _mood_cache.get(key)
+    if entry and time.monotonic() < entry[1]:
+        return entry[0]
+    if entry:
+        del _mood_cache[key]
+    return None
+
+def _mood_cache_put(key: bytes, mood: str) -> None:
+    while len(_mood_cache) >= _MOOD_CACHE_MAX:  # dict is insertion-ordered: evict oldest
+        del _mood_cache[next(iter(_mood_cache))]
+    _mood_cache[key] = (mood, time.monotonic() + _MOOD_CACHE_TTL)
+
+# Optional local mood classifier: an embedding lookup against precomputed
+# label centroids turns a ~1s chat completion into a ~5ms local vector op.
+# Loaded lazily on first use; everything degrades to the LLM path when
+# sentence-transformers is not installed.
+_mood_classifier = None
+_mood_label_embs = None
+
+def _classify_mood_local(text: str) -> Optional[str]:
+    """Map text to a mood label via embedding similarity. BLOCKING on first call."""
+    global _mood_classifier, _mood_label_embs
+    if not _HAS_SENTENCE_TRANSFORMERS:
+        return None
+    try:
+        if _mood_classifier is None:
+            from sentence_transformers import SentenceTransformer
+            _mood_classifier = SentenceTransformer("all-MiniLM-L6-v2")
+            _mood_label_embs = _mood_classifier.encode(
+                [f"feeling {m}" for m in _VALID_MOODS], normalize_embeddings=True)
+        emb = _mood_classifier.encode(text, normalize_embeddings=True)
+        scores = _mood_label_embs @ emb
+        best = int(scores.argmax())
+        return _VALID_MOODS[best] if scores[best] >= 0.35 else "neutral"
+    except Exception as e:
+        logger.error(f"Local mood classifier failed, falling back to LLM: {e}")
+        return None
 
-        is_request = result.get("is_music_request", False)
-        # Robust boolean conversion
+# Local prefilter: obvious "play/download X" phrasings are classified by a
+# compiled regex for free instead of paying a 1-2s LLM round trip.
+_MUSIC_INTENT_RE = re.compile(
+    r"\b(?:play|download|put on|queue|stream|find (?:me )?(?:the )?song)\b\s+([^\n]{2,80})", re.I)
+
+# Broader keyword sniff: if a message contains none of these, it is general
+# chat and has essentially zero chance of being a song request.
+_MUSIC_KEYWORD_RE = re.compile(
+    r"\b(?:play|download|song|track|music|listen|album|artist|queue|stream|put on)\b", re.I)
+
+# System message built once - the per-call list only allocates the user turn.
+_ANALYZE_SYS_MSG = {"role": "system", "content":
+    "You are an AI that analyzes a user message for a music bot. "
+    "Respond in JSON with three fields: 'mood' (one of happy, sad, anxious, excited, calm, angry, energetic, relaxed, focused, nostalgic, or neutral if unclear), "
+    "'is_music_request' (boolean) and 'song_query' (string with the song title/artist, or null). "
+    "Focus on explicit requests like 'play X by Y', 'download Z', 'find song A'. General music chat or mood expression is NOT a specific song request unless they name something specific they want *now*. If they ask 'can you play X?', that is a request."
+}
+
+# Coalesce duplicate in-flight analyses: a user spamming the same text must
+# not fan out into parallel LLM calls - later arrivals await the first task.
+_inflight_analysis: Dict[Tuple[int, str], "asyncio.Task"] = {}
+
+# Per-user debounce for mood-only LLM calls: a user typing several quick
+# messages should not fire one mood classification per line.
+_MOOD_LLM_DEBOUNCE_SECONDS = 2.0
+_mood_llm_last: Dict[int, float] = {}
+
+async def analyze_message(user_id: int, text: str) -> Dict:
+    """Deduplicating front door for _analyze_message_impl."""
+    key = (user_id, text)
+    pending = _inflight_analysis.get(key)
+    if pending is not None:
+        return await pending
+    task = asyncio.ensure_future(_analyze_message_impl(user_id, text))
+    _inflight_analysis[key] = task
+    try:
+        return await task
+    finally:
+        _inflight_analysis.pop(key, None)
+
+async def _analyze_message_impl(user_id: int, text: str) -> Dict:
+    """Classify mood and music intent in ONE chat-completion call.
+
+    The message handler used to pay two LLM round trips per inbound text
+    (detect_mood_from_text + is_music_request); fusing them halves the
+    wall-clock analysis time and the token overhead.
+    """
+    result = {"mood": None, "is_music_request": False, "song_query": None}
+
+    cache_key = _mood_cache_key(text)
+    result["mood"] = _mood_cache_get(cache_key)
+    if result["mood"] is None and _HAS_SENTENCE_TRANSFORMERS:
+        result["mood"] = await asyncio.to_thread(_classify_mood_local, text)
+        if result["mood"] is not None:
+            _mood_cache_put(cache_key, result["mood"])
+
+    # Length/content gate: one-word greetings, multi-hundred-char rants and
+    # alpha-free messages essentially never contain a song request, so they
+    # skip the LLM entirely (URLs are already handled before analysis).
+    plausible_request = 4 <= len(text) <= 300 and any(c.isalpha() for c in text)
+
+    intent_match = _MUSIC_INTENT_RE.search(text) if plausible_request else None
+    if intent_match:
+        result["is_music_request"] = True
+        result["song_query"] = intent_match.group(1).strip()
+        logger.info("Regex prefilter matched music request (user %s): query='%s'", user_id, result["song_query"])
+        return result
+
+    if not client or not plausible_request:
+        return result
+
+    # Plain chat with a known mood and no music keyword anywhere skips the
+    # LLM call entirely - the round trip is the dominant cost per message
+    # and the vast majority of chat is not a song request.
+    has_music_keyword = _MUSIC_KEYWORD_RE.search(text) is not None
+    if result["mood"] is not None and not has_music_keyword:
+        return result
+
+    # Mood-only calls (no music keyword) are debounced per user: rapid
+    # consecutive messages within the window reuse the pending/last mood
+    # instead of each paying an LLM round trip.
+    if not has_music_keyword:
+        now = time.monotonic()
+        if now - _mood_llm_last.get(user_id, 0.0) < _MOOD_LLM_DEBOUNCE_SECONDS:
+            return result
+        _mood_llm_last[user_id] = now
+        if len(_mood_llm_last) > 4096:
+            _mood_llm_last.pop(next(iter(_mood_llm_last)))
+
+    logger.debug("AI: fused mood/intent analysis for user %s: '%.50s...'", user_id, text)
+    try:
+        response = await client.chat.completions.create(
+            model=FAST_MODEL,
+            messages=[_ANALYZE_SYS_MSG, {"role": "user", "content": f"Analyze message: '{text}'"}],
+            max_tokens=60,
+            temperature=0.05,
+            response_format={"type": "json_object"}
+        )
+        parsed = _json_loads(response.choices[0].message.content)
+        if not isinstance(parsed, dict):
+            logger.error(f"Fused analysis (user {user_id}) returned non-dict: {response.choices[0].message.content}")
+            return result
+
+        if result["mood"] is None:
+            mood_raw = _MOOD_NOISE_RE.sub("", str(parsed.get("mood", ""))).lower()
+            mood = _MOOD_MAP.get(mood_raw, mood_raw)
+            if mood in _VALID_MOOD_SET:
+                result["mood"] = mood
+                _mood_cache_put(cache_key, mood)
+
+        is_request = parsed.get("is_music_request", False)
         if isinstance(is_request, str): is_request = is_request.lower() in ("true", "yes", "1")
-        
-        song_query = result.get("song_query")
-        if not isinstance(song_query, str) or not song_query.strip(): song_query = None 
+        result["is_music_request"] = bool(is_request)
 
-        logger.info(f"AI music request (user {user_id}): is_request={is_request}, query='{song_query}' for msg: '{message[:30]}...'")
-        return {
-            "is_music_request": bool(is_request),
-            "song_query": song_query
-        }
-    except json.JSONDecodeError as jde:
-        logger.error(f"AI music request JSON (user {user_id}) decode error: {jde}. Raw: {response.choices[0].message.content if 'response' in locals() and response.choices else 'N/A'}")
-        return {"is_music_request": False, "song_query": None}
+        song_query = parsed.get("song_query")
+        if isinstance(song_query, str) and song_query.strip():
+            result["song_query"] = song_query.strip()
+
+        logger.info("Fused analysis (user %s): mood=%s, is_request=%s, query='%s'", user_id, result["mood"], result["is_music_request"], result["song_query"])
+        return result
+    except ValueError as jde:  # json.JSONDecodeError / orjson.JSONDecodeError
+        logger.error(f"Fused analysis JSON (user {user_id}) decode error: {jde}")
     except Exception as e:
-        logger.error(f"Error in AI is_music_request for user {user_id}: {e}", exc_info=True) # exc_info=True for debugging
-        return {"is_music_request": False, "song_query": None}
+        # No traceback on the bulk path: if the API starts 429'ing, every
+        # message would otherwise pay a stack walk + large string format.
+        logger.warning(f"Error in fused message analysis for user {user_id}: {e}",
+                       exc_info=logger.isEnabledFor(logging.DEBUG))
+    if result["mood"] is None:
+        result["mood"] = _mood_cache_get(cache_key)
+    return result
 
 
 # ==================== TELEGRAM BOT HANDLERS ====================
 
+# Fire-and-forget temp-file deletion: paths are queued and a single worker
+# unlinks them in a thread, so the send path never waits on disk - on slow
+# disks a synchronous unlink can cost tens of ms.
+_cleanup_queue: "asyncio.Queue[str]" = asyncio.Queue()
+_cleanup_worker_task: Optional["asyncio.Task"] = None
+
+async def _cleanup_worker() -> None:
+    while True:
+        path = await _cleanup_queue.get()
+        try:
+            await asyncio.to_thread(os.unlink, path)
+            logger.info(f"Deleted temp file: {path}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error deleting temp file {path}: {e}")
+
+def _enqueue_file_cleanup(audio_path: str) -> None:
+    global _cleanup_worker_task
+    if _cleanup_worker_task is None or _cleanup_worker_task.done():
+        _cleanup_worker_task = asyncio.create_task(_cleanup_worker())
+    _cleanup_queue.put_nowait(audio_path)
+
+async def _cleanup_after_send(status_msg, audio_path: str) -> None:
+    """Delete the status message and queue the temp file for deletion."""
+    _enqueue_file_cleanup(audio_path)
+    try:
+        await status_msg.delete()
+    except Exception:
+        pass
+
+# Download-skipping cache: video_id -> (telegram file_id, title, performer,
+# duration). Once a YouTube track has been uploaded, later requests for the
+# same video send the cached file_id directly - no yt-dlp run, no upload.
+YT_FILE_CACHE: Dict[str, Tuple[str, str, str, int]] = {}
+YT_FILE_CACHE_MAX = 512
+
+def _yt_file_cache_put(video_id: str, file_id: str, title: str, performer: str, duration: int) -> None:
+    while len(YT_FILE_CACHE) >= YT_FILE_CACHE_MAX:  # evict oldest
+        del YT_FILE_CACHE[next(iter(YT_FILE_CACHE))]
+    YT_FILE_CACHE[video_id] = (file_id, title, performer, duration)
+
+# Telegram deduplicates uploads by file_id: once a track has been uploaded,
+# re-sends pass the cached id string and skip the multi-MB upload entirely.
+# Keyed by content digest so the same song hits across separate downloads.
+_TG_FILE_ID_CACHE: Dict[bytes, str] = {}
+_TG_FILE_ID_CACHE_MAX = 256
+
+def _read_audio_and_digest(audio_path: str) -> Tuple[bytes, bytes]:
+    """Read the file and hash it in one pass. BLOCKING - call off the loop."""
+    with open(audio_path, 'rb') as f:
+        data = f.read()
+    return data, hashlib.sha1(data).digest()
+
 async def send_audio_via_bot(bot, chat_id, audio_path, title, performer, caption, duration, reply_to_message_id=None):
     """Helper to send audio using PTB."""
     try:
-        with open(audio_path, 'rb') as audio_file_obj:
+        data, digest = await asyncio.to_thread(_read_audio_and_digest, audio_path)
+        cached_file_id = _TG_FILE_ID_CACHE.get(digest)
+        if cached_file_id:
+            logger.info(f"Sending audio '{title}' to chat {chat_id} via cached file_id (no re-upload).")
+        else:
             logger.info(f"Sending audio '{title}' to chat {chat_id}. Path: {audio_path}")
-            await bot.send_audio(
-                chat_id=chat_id,
-                audio=audio_file_obj,
-                title=title[:64], # Telegram's internal limits might be around this
-                performer=performer[:64] if performer else "Unknown Artist",
-                caption=caption,
-                duration=duration,
-                reply_to_message_id=reply_to_message_id,
-                parse_mode=ParseMode.HTML
-            )
+        message = await bot.send_audio(
+            chat_id=chat_id,
+            audio=cached_file_id or BytesIO(data),
+            filename=os.path.basename(audio_path),
+            title=title[:64], # Telegram's internal limits might be around this
+            performer=performer[:64] if performer else "Unknown Artist",
+            caption=caption,
+            duration=duration,
+            reply_to_message_id=reply_to_message_id,
+            parse_mode=ParseMode.HTML
+        )
+        if cached_file_id is None and message and message.audio:
+            while len(_TG_FILE_ID_CACHE) >= _TG_FILE_ID_CACHE_MAX:  # evict oldest
+                del _TG_FILE_ID_CACHE[next(iter(_TG_FILE_ID_CACHE))]
+            _TG_FILE_ID_CACHE[digest] = message.audio.file_id
+        return message
     except FileNotFoundError:
         logger.error(f"Audio file not found for sending: {audio_path}")
         await bot.send_message(chat_id, "Sorry, there was an issue preparing the audio file. It might have been removed.")
     except Exception as e:
         logger.error(f"Error sending audio file {audio_path} to chat {chat_id}: {e}", exc_info=True)
         await bot.send_message(chat_id, "Sorry, an error occurred while sending the audio file.")
+    return None
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a welcome message."""
     user = update.effective_user
-    user_contexts.setdefault(user.id, {"mood": None, "preferences": [], "conversation_history": [], "spotify": {}})
+    user_contexts[user.id]  # defaultdict: allocates only on first sight
 
     welcome_msg = (
         f"Hi {user.first_name}! 👋 I'm MelodyMind, your Music Healing Companion.\n\n"
@@ -769,16 +1408,42 @@ async def download_music(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     user_id = update.effective_user.id
-    if user_id in active_downloads:
+
+    # Viral-song fast path: if this video was already uploaded to Telegram,
+    # send the cached file_id and skip yt-dlp and the upload entirely.
+    video_id_match = _YT_ID_RE.search(url_to_download)
+    cached_entry = YT_FILE_CACHE.get(video_id_match.group(1)) if video_id_match else None
+    if cached_entry:
+        file_id, cached_title, cached_performer, cached_duration = cached_entry
+        logger.info(f"Serving '{cached_title}' to user {user_id} from the Telegram file cache.")
+        try:
+            await context.bot.send_audio(
+                chat_id=update.effective_chat.id,
+                audio=file_id,
+                title=cached_title[:64],
+                performer=cached_performer[:64] if cached_performer else "Unknown Artist",
+                caption=f"🎵 Here's your track: <b>{cached_title}</b>",
+                duration=cached_duration,
+                reply_to_message_id=update.message.message_id,
+                parse_mode=ParseMode.HTML
+            )
+            return
+        except Exception as e:
+            # Stale/revoked file_id - drop it and fall through to a fresh download.
+            logger.warning(f"Cached file_id send failed for {url_to_download}, re-downloading: {e}")
+            YT_FILE_CACHE.pop(video_id_match.group(1), None)
+
+    dl_lock = _download_lock_for(user_id)
+    if dl_lock.locked():
         await update.message.reply_text("⚠️ One download at a time, please! Your current download is still in progress. 😊")
         return
 
-    active_downloads.add(user_id)
+    await dl_lock.acquire()
     status_msg = await update.message.reply_text("⏳ Starting download... please wait!", parse_mode=ParseMode.HTML)
 
     try:
         await status_msg.edit_text("🔍 Fetching video info & preparing audio download...", parse_mode=ParseMode.HTML)
-        result = await asyncio.to_thread(download_youtube_audio_sync, url_to_download)
+        result = await download_youtube_audio(url_to_download)
         
         if not result["success"]:
             error_message = result.get('error', 'Unknown download error.')
@@ -787,7 +1452,7 @@ async def download_music(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
         await status_msg.edit_text(f"✅ Downloaded: <b>{result['title']}</b>\n⏳ Sending you the audio file...", parse_mode=ParseMode.HTML)
         
-        await send_audio_via_bot(
+        sent_message = await send_audio_via_bot(
             bot=context.bot,
             chat_id=update.effective_chat.id,
             audio_path=result["audio_path"],
@@ -797,16 +1462,14 @@ async def download_music(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             duration=result.get("duration"),
             reply_to_message_id=update.message.message_id
         )
+        if sent_message and sent_message.audio and video_id_match:
+            _yt_file_cache_put(video_id_match.group(1), sent_message.audio.file_id,
+                               result["title"], result.get("artist") or "",
+                               result.get("duration") or 0)
 
-        if os.path.exists(result["audio_path"]):
-            try:
-                os.remove(result["audio_path"])
-                logger.info(f"Deleted temp file: {result['audio_path']} (user: {user_id})")
-            except OSError as e:
-                logger.error(f"Error deleting temp file {result['audio_path']} (user: {user_id}): {e}")
-        try:
-            await status_msg.delete()
-        except Exception: pass 
+        # The two cleanups are independent - overlap them and keep the
+        # (potentially slow-disk) unlink off the event loop.
+        await _cleanup_after_send(status_msg, result["audio_path"])
 
     except TimedOut:
         logger.error(f"Telegram API timeout during download (user {user_id}, url: {url_to_download})")
@@ -821,8 +1484,36 @@ async def download_music(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         except Exception:
             logger.error(f"Failed to send final error message for download to user {user_id}")
     finally:
-        active_downloads.discard(user_id)
+        dl_lock.release()
+
+
+async def get_spotify_profile_id(user_id: int) -> Optional[str]:
+    """Return the user's Spotify profile id, fetching /v1/me only once per account.
+
+    The id never changes for a linked account, so it is cached in the user
+    context (and persisted with it) after the first successful lookup.
+    """
+    spotify_ctx = user_contexts[user_id].setdefault("spotify", {})
+    cached_id = spotify_ctx.get("profile_id")
+    if cached_id:
+        return cached_id
 
+    access_token = await get_user_spotify_access_token(user_id)
+    if not access_token:
+        return None
+    try:
+        session = await get_http_session()
+        async with session.get("https://api.spotify.com/v1/me",
+                               headers={"Authorization": f"Bearer {access_token}"}) as response:
+            response.raise_for_status()
+            profile_id = (await response.json(loads=_json_loads)).get("id")
+    except aiohttp.ClientError as e:
+        logger.error(f"API error fetching Spotify profile for user {user_id}: {e}")
+        return None
+    if profile_id:
+        spotify_ctx["profile_id"] = profile_id
+        mark_contexts_dirty()
+    return profile_id
 
 async def create_playlist(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Create a private Spotify playlist."""
@@ -845,23 +1536,14 @@ async def create_playlist(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
 
-    # Get Spotify User ID
-    user_profile_url = "https://api.spotify.com/v1/me"
+    # Get Spotify User ID (cached after first lookup - it never changes)
     headers_auth = {"Authorization": f"Bearer {access_token}"}
-    spotify_user_id_from_api = None
     try:
-        async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
-            async with session.get(user_profile_url, headers=headers_auth) as response:
-                response.raise_for_status()
-                spotify_user_id_from_api = (await response.json()).get("id")
+        spotify_user_id_from_api = await get_spotify_profile_id(user_id)
         if not spotify_user_id_from_api:
             logger.error(f"Could not retrieve Spotify user ID for Telegram user {user_id}.")
             await update.message.reply_text("Sorry, I couldn't get your Spotify profile ID. This is needed to create playlists.")
             return
-    except aiohttp.ClientError as e:
-        logger.error(f"API error fetching Spotify profile for user {user_id}: {e}")
-        await update.message.reply_text("There was an issue fetching your Spotify profile. Please try again.")
-        return
     except Exception as e:
         logger.error(f"Unexpected error fetching Spotify profile for user {user_id}: {e}", exc_info=True)
         await update.message.reply_text("An unexpected error occurred while fetching your Spotify profile.")
@@ -873,17 +1555,17 @@ async def create_playlist(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     payload = {"name": playlist_name, "public": False, "description": f"Created with MelodyMind Bot @ {datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M %Z')}"}
 
     try:
-        async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
-            async with session.post(playlist_creation_url, headers=headers_create, json=payload) as response:
-                response.raise_for_status()
-                playlist_data = await response.json()
-                playlist_url = playlist_data.get("external_urls", {}).get("spotify", "#") # Get public URL
-                logger.info(f"Playlist '{playlist_name}' created successfully for user {user_id}. URL: {playlist_url}")
-                await update.message.reply_text(
-                    f"🎉 Playlist '<b>{playlist_name}</b>' created successfully!\n"
-                    f"You can view it here: {playlist_url}",
-                    parse_mode=ParseMode.HTML, disable_web_page_preview=True
-                )
+        session = await get_http_session()
+        async with session.post(playlist_creation_url, headers=headers_create, json=payload) as response:
+            response.raise_for_status()
+            playlist_data = await response.json(loads=_json_loads)
+            playlist_url = playlist_data.get("external_urls", {}).get("spotify", "#") # Get public URL
+            logger.info(f"Playlist '{playlist_name}' created successfully for user {user_id}. URL: {playlist_url}")
+            await update.message.reply_text(
+                f"🎉 Playlist '<b>{playlist_name}</b>' created successfully!\n"
+                f"You can view it here: {playlist_url}",
+                parse_mode=ParseMode.HTML, disable_web_page_preview=True
+            )
     except aiohttp.ClientError as e:
         status = getattr(e, 'status', 'N/A')
         message_detail = getattr(e, 'message', str(e)) # Get a more detailed message if available
@@ -893,6 +1575,17 @@ async def create_playlist(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.error(f"Unexpected error creating playlist '{playlist_name}' for user {user_id}: {e}", exc_info=True)
         await update.message.reply_text("An unexpected error occurred while creating the playlist.")
 
+# Lazily loaded local speech-to-text model (optional; see WhisperModel import).
+_whisper_model = None
+
+def _get_whisper_model():
+    """Load the int8 Whisper model on first use. BLOCKING - call off the loop."""
+    global _whisper_model
+    if _whisper_model is None:
+        from faster_whisper import WhisperModel
+        _whisper_model = WhisperModel("base.en", device="cpu", compute_type="int8")
+    return _whisper_model
+
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle voice messages by transcribing them."""
     if not update.message or not update.message.voice or not update.effective_user:
@@ -903,17 +1596,26 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     
     try:
         voice_file = await context.bot.get_file(update.message.voice.file_id)
-        # Generate a unique filename for the temporary OGG file
-        temp_ogg_path = os.path.join(DOWNLOAD_DIR, f"voice_{user_id}_{update.message.message_id}_{datetime.now().timestamp()}.ogg")
-        
-        await voice_file.download_to_drive(temp_ogg_path)
-        logger.debug(f"Voice message from user {user_id} downloaded to {temp_ogg_path}")
-
-        recognizer = sr.Recognizer()
-        transcribed_text = None
+        # Download straight into memory - voice notes are small, and skipping
+        # the temp file removes two syscalls plus the cleanup branch per clip.
+        voice_buf = BytesIO()
+        await voice_file.download_to_memory(voice_buf)
+        voice_buf.seek(0)
+        logger.debug("Voice message from user %s downloaded to memory (%s bytes)", user_id, voice_buf.getbuffer().nbytes)
 
         def _transcribe_audio_sync_wrapper(): # Wrapper for asyncio.to_thread
-            with sr.AudioFile(temp_ogg_path) as source:
+            if _HAS_FASTER_WHISPER:
+                # Local int8 Whisper: no network round trip, ~2-3x faster than
+                # FP32 and decodes OGG directly (no AudioFile conversion).
+                try:
+                    segments, _ = _get_whisper_model().transcribe(voice_buf, beam_size=1)
+                    text = " ".join(segment.text.strip() for segment in segments).strip()
+                    return text or None
+                except Exception as whisper_e:
+                    logger.error(f"Local Whisper transcription failed for user {user_id}, falling back to Google: {whisper_e}")
+                voice_buf.seek(0)
+            recognizer = sr.Recognizer()
+            with sr.AudioFile(voice_buf) as source:
                 audio_data = recognizer.record(source)  # Read the entire audio file
             try:
                 return recognizer.recognize_google(audio_data) # Using Google Web Speech API
@@ -944,14 +1646,6 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     except Exception as e:
         logger.error(f"Error processing voice message from user {user_id}: {e}", exc_info=True)
         await update.message.reply_text("Oops! Something went wrong while processing your voice message. Please try again.")
-    finally:
-        # Clean up the temporary OGG file
-        if 'temp_ogg_path' in locals() and os.path.exists(temp_ogg_path): # Ensure var defined and file exists
-            try:
-                os.remove(temp_ogg_path)
-                logger.debug(f"Deleted temporary voice file: {temp_ogg_path}")
-            except OSError as e_del:
-                logger.error(f"Error deleting temporary voice file {temp_ogg_path}: {e_del}")
 
 
 async def link_spotify(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -972,15 +1666,8 @@ async def link_spotify(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
 
     user_id = update.effective_user.id
-    scopes = "user-read-recently-played user-top-read playlist-modify-private" # Define scopes required
-    auth_url = (
-        "https://accounts.spotify.com/authorize"
-        f"?client_id={SPOTIFY_CLIENT_ID}"
-        "&response_type=code"
-        f"&redirect_uri={SPOTIFY_REDIRECT_URI}"
-        f"&scope={scopes.replace(' ', '%20')}" # URL-encode scopes
-        f"&state={user_id}" # Use user_id as state to associate code with user
-    )
+    # state associates the returned code with this user
+    auth_url = _SPOTIFY_AUTH_URL_TEMPLATE.format(user_id=user_id)
     keyboard = [
         [InlineKeyboardButton("🔗 Link My Spotify Account", url=auth_url)],
         [InlineKeyboardButton("Cancel Linking", callback_data=CB_CANCEL_SPOTIFY)]
@@ -1037,14 +1724,16 @@ async def spotify_code_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         return SPOTIFY_CODE # Stay in state, user needs to try again or provide new code
 
     # Successfully got tokens, store them (encrypted)
-    user_contexts.setdefault(user_id, {"mood": None, "preferences": [], "conversation_history": [], "spotify": {}})
+    user_contexts[user_id]  # defaultdict: allocates only on first sight
     # Ensure 'spotify' dict exists
     user_contexts[user_id].setdefault("spotify", {})
 
     user_contexts[user_id]["spotify"]["access_token"] = cipher.encrypt(token_data["access_token"].encode())
     user_contexts[user_id]["spotify"]["refresh_token"] = cipher.encrypt(token_data["refresh_token"].encode()) 
     user_contexts[user_id]["spotify"]["expires_at"] = token_data["expires_at"]
+    mark_contexts_dirty()
     logger.info(f"Spotify account successfully linked for user {user_id}.")
+    asyncio.create_task(get_spotify_profile_id(user_id))  # warm the profile-id cache
 
     # Try to fetch some immediate personalized info as feedback
     rp_info_str = ""
@@ -1110,7 +1799,7 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = " ".join(context.args)
     status_msg = await update.message.reply_text(f"🔍 Searching YouTube for: '<i>{query}</i>'...", parse_mode=ParseMode.HTML)
     
-    results = await asyncio.to_thread(search_youtube_sync, query, max_results=5)
+    results = await search_youtube(query, max_results=5)
     
     try:
         await status_msg.delete() 
@@ -1130,6 +1819,27 @@ async def auto_download_command(update: Update, context: ContextTypes.DEFAULT_TY
     await auto_download_first_result(update, context, query, original_message_to_reply_to=update.message.message_id)
 
 
+def _chunk_lyrics(text: str, max_len: int):
+    """Yield message-sized lyric chunks, breaking at blank lines when possible.
+
+    Single forward pass over the immutable string; rfind with explicit
+    bounds scans for break points without intermediate copies.
+    """
+    pos = 0
+    n = len(text)
+    while pos < n:
+        end = min(pos + max_len, n)
+        if end < n:
+            cut = text.rfind('\n\n', pos, end)  # prefer a stanza boundary
+            if cut == -1 or cut < pos + max_len - 500:
+                cut = text.rfind('\n', pos, end)
+            if cut == -1 or cut < pos + max_len - 300:
+                cut = end
+        else:
+            cut = end
+        yield text[pos:cut]
+        pos = cut
+
 async def get_lyrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle lyrics requests via /lyrics command."""
     if not update.message: return
@@ -1149,54 +1859,43 @@ async def get_lyrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     try:
         artist = None
         song_title = query
-        # Attempt to parse "Artist - Song" or "Song by Artist"
+        # Attempt to parse "Artist - Song" or "Song by Artist". Plain substring
+        # scans (C-level memchr) instead of a backtracking regex per command.
         if " - " in query:
             parts = query.split(" - ", 1)
             artist, song_title = parts[0].strip(), parts[1].strip()
-        elif " by " in query.lower(): # More flexible "by" parsing
-            match = re.search(r'^(.*?)\s+by\s+(.*?)$', query, re.IGNORECASE)
-            if match:
-                song_title, artist = match.group(1).strip(), match.group(2).strip()
+        else:
+            idx = query.lower().rfind(" by ")
+            if idx > 0:
+                song_title, artist = query[:idx].strip(), query[idx + 4:].strip()
         
         logger.info(f"Lyrics command processing: song='{song_title}', artist='{artist}' (original query: '{query}')")
         
-        lyrics_text = await asyncio.to_thread(get_lyrics_sync, song_title, artist)
+        lyrics_text = await get_lyrics(song_title, artist)
         
-        max_len = 4090 # Telegram message length limit (slightly less for safety)
-        if len(lyrics_text) > max_len:
-            current_message = status_msg # Start with the status message to edit
-            sent_chars = 0
-            
-            parts = []
-            while len(lyrics_text) > 0:
-                chunk = lyrics_text[:max_len]
-                lyrics_text = lyrics_text[max_len:]
-
-                if len(lyrics_text) > 0: # If there's more to come
-                    # Try to break at a double newline for cleaner separation
-                    cut_point = chunk.rfind('\n\n')
-                    if cut_point == -1 or cut_point < max_len - 500: # If no good \n\n or too early, try single \n
-                        cut_point = chunk.rfind('\n')
-                    if cut_point == -1 or cut_point < max_len - 300 : # If still no good \n, just cut at max_len
-                        cut_point = max_len
-                    
-                    parts.append(chunk[:cut_point])
-                    lyrics_text = chunk[cut_point:] + lyrics_text # Prepend remainder to next chunk
-                else:
-                    parts.append(chunk)
-
-            for i, part_text in enumerate(parts):
-                is_last_part = (i == len(parts) - 1)
-                text_to_send = part_text
-                if not is_last_part:
-                    text_to_send += "\n\n<small><i>(lyrics continued below...)</i></small>"
-                
-                if i == 0: # First part, edit status message
-                    await current_message.edit_text(text_to_send, parse_mode=ParseMode.HTML)
-                else: # Subsequent parts, send new message
-                    await update.message.reply_text(text_to_send, parse_mode=ParseMode.HTML)
-        else: # Lyrics fit in one message
+        # Fast path first: most lyrics fit in one message, so the common case
+        # is a single straight-line edit with no chunking state at all.
+        if len(lyrics_text) <= _TG_MSG_MAX:
             await status_msg.edit_text(lyrics_text, parse_mode=ParseMode.HTML)
+        else:
+            # Chunking still runs through the generator, but the parts are
+            # counted up front (cheap - lyrics are a few KB) so each carries a
+            # part N/M marker: the non-first sends go out concurrently under a
+            # semaphore below Telegram's ~30 msg/s ceiling, and the numbering
+            # keeps a rare out-of-order arrival readable.
+            parts = list(_chunk_lyrics(lyrics_text, _TG_MSG_MAX))
+            total = len(parts)
+            texts = [
+                part_text if i == total - 1
+                else part_text + f"\n\n<small><i>(lyrics part {i + 1}/{total}, continued below...)</i></small>"
+                for i, part_text in enumerate(parts)
+            ]
+            await status_msg.edit_text(texts[0], parse_mode=ParseMode.HTML)
+            send_sem = asyncio.Semaphore(25)
+            async def _send_part(part: str) -> None:
+                async with send_sem:
+                    await update.message.reply_text(part, parse_mode=ParseMode.HTML)
+            await asyncio.gather(*(_send_part(t) for t in texts[1:]), return_exceptions=True)
 
     except Exception as e: 
         logger.error(f"Error in get_lyrics_command (query '{query}'): {e}", exc_info=True)
@@ -1213,26 +1912,14 @@ async def provide_generic_recommendations(update: Update, mood: str, chat_id_ove
     logger.info(f"Providing generic recommendations for mood: {mood} to chat ID {chat_id_override or update.effective_chat.id}")
     target_chat_id = chat_id_override or update.effective_chat.id # Ensure chat_id is defined
 
-    mood_recommendations = {
-        "happy": ["Uptown Funk - Mark Ronson", "Happy - Pharrell Williams", "Walking on Sunshine - Katrina & The Waves"],
-        "sad": ["Someone Like You - Adele", "Hallelujah - Leonard Cohen (Jeff Buckley version)", "Fix You - Coldplay"],
-        "energetic": ["Don't Stop Me Now - Queen", "Thunderstruck - AC/DC", "Can't Stop the Feeling! - Justin Timberlake"],
-        "relaxed": ["Weightless - Marconi Union", "Clair de Lune - Debussy", "Orinoco Flow - Enya"],
-        "focused": ["The Four Seasons - Vivaldi (Max Richter recomposed)", "Time - Hans Zimmer", "Ambient 1: Music for Airports - Brian Eno"],
-        "nostalgic": ["Bohemian Rhapsody - Queen", "Yesterday - The Beatles", "Wonderwall - Oasis"],
-        "default": ["Three Little Birds - Bob Marley", "Here Comes The Sun - The Beatles", "What a Wonderful World - Louis Armstrong"]
-    }
-
     chosen_mood_key = mood.lower()
-    if chosen_mood_key not in mood_recommendations:
+    if chosen_mood_key not in _MOOD_RECS:
         logger.warning(f"Generic mood '{mood}' not in list, defaulting to 'default' recommendations.")
         chosen_mood_key = "default" 
         
-    recommendations = mood_recommendations.get(chosen_mood_key, mood_recommendations["default"]) 
-    response_text = f"🎵 Here are some general song suggestions for a <b>{mood.capitalize()}</b> vibe:\n\n"
-    for i, track in enumerate(recommendations, 1):
-        response_text += f"{i}. {track}\n"
-    response_text += "\n💡 <i>You can ask me to search or download any of these! (e.g., /autodownload {track example})</i>"
+    # Body is pre-rendered per mood at import; only the header varies.
+    response_text = (f"🎵 Here are some general song suggestions for a <b>{mood.capitalize()}</b> vibe:\n\n"
+                     + _MOOD_RECS_BODY[chosen_mood_key])
     
     await context.bot.send_message(chat_id=target_chat_id, text=response_text, parse_mode=ParseMode.HTML)
 
@@ -1242,18 +1929,9 @@ async def set_mood(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if not update.effective_user : return ConversationHandler.END # Should not happen
 
     user = update.effective_user
-    user_contexts.setdefault(user.id, {"mood": None, "preferences": [], "conversation_history": [], "spotify": {}})
+    user_contexts[user.id]  # defaultdict: allocates only on first sight
 
-    keyboard = [
-        [InlineKeyboardButton("Happy 😊", callback_data=f"{CB_MOOD_PREFIX}happy"),
-         InlineKeyboardButton("Sad 😢", callback_data=f"{CB_MOOD_PREFIX}sad")],
-        [InlineKeyboardButton("Energetic 💪", callback_data=f"{CB_MOOD_PREFIX}energetic"),
-         InlineKeyboardButton("Relaxed 😌", callback_data=f"{CB_MOOD_PREFIX}relaxed")],
-        [InlineKeyboardButton("Focused 🧠", callback_data=f"{CB_MOOD_PREFIX}focused"),
-         InlineKeyboardButton("Nostalgic 🕰️", callback_data=f"{CB_MOOD_PREFIX}nostalgic")],
-         [InlineKeyboardButton("Neutral / Other", callback_data=f"{CB_MOOD_PREFIX}neutral")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _MOOD_KEYBOARD
     current_mood = user_contexts[user.id].get("mood")
     prompt_text = f"Hi {user.first_name}! "
     if current_mood and current_mood != "neutral":
@@ -1268,6 +1946,10 @@ async def set_mood(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await update.message.reply_text(prompt_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     return MOOD 
 
+# Invariant "Cancel Search" row shared across every search-result keyboard -
+# PTB serializes markup without mutating it, so one instance is safe.
+_CANCEL_SEARCH_ROW = [InlineKeyboardButton("Cancel Search", callback_data=CB_CANCEL_SEARCH)]
+
 async def send_search_results(update: Update, query: str, results: List[Dict]) -> None:
     """Send YouTube search results with inline keyboard for download."""
     # Ensure there's a message to reply to or context to send a new message
@@ -1283,14 +1965,19 @@ async def send_search_results(update: Update, query: str, results: List[Dict]) -
         return
 
     keyboard_rows = []
-    response_text_header = f"🔎 YouTube search results for '<i>{query}</i>':\n\n"
+    # Built as fragments and joined once - repeated += rebuilds the whole
+    # string per result.
+    response_parts = [f"🔎 YouTube search results for '<i>{query}</i>':\n\n"]
     
     valid_results_count = 0
-    for i, result in enumerate(results[:5]): # Show top 5
+    _yt_id_match = _YT_ID_EXACT_RE.match  # hoisted attribute lookup
+    for result in results:
+        if valid_results_count == 5: # Show top 5 valid; break beats slicing
+            break
         # Validate essential fields
         video_id = result.get('id')
         title = result.get('title')
-        if not video_id or not title or not re.match(r'^[0-9A-Za-z_-]{11}$', video_id):
+        if not video_id or not title or not _yt_id_match(video_id):
             logger.warning(f"Skipping invalid YouTube search result item (ID: {video_id}, Title: {title}) for query '{query}'")
             continue
         valid_results_count +=1
@@ -1308,17 +1995,18 @@ async def send_search_results(update: Update, query: str, results: List[Dict]) -
         button_display_title = (title[:35] + "...") if len(title) > 38 else title
         button_text = f"[{valid_results_count}] {button_display_title}{duration_str}"
         
-        response_text_header += f"{valid_results_count}. <b>{title}</b> by <i>{result.get('uploader', 'N/A')}</i>{duration_str}\n"
-        keyboard_rows.append([InlineKeyboardButton(button_text, callback_data=f"{CB_DOWNLOAD_PREFIX}{video_id}")])
+        response_parts.append(f"{valid_results_count}. <b>{title}</b> by <i>{result.get('uploader', 'N/A')}</i>{duration_str}\n")
+        keyboard_rows.append([InlineKeyboardButton(button_text, callback_data=CB_DOWNLOAD_PREFIX + video_id)])
 
     if not keyboard_rows: # Should only happen if all results were invalid
         await context.bot.send_message(chat_id=target_chat_id, text=f"😕 Found some YouTube results for '<i>{query}</i>', but had trouble processing them. Please try again.", parse_mode=ParseMode.HTML)
         return
 
-    keyboard_rows.append([InlineKeyboardButton("Cancel Search", callback_data=CB_CANCEL_SEARCH)])
+    keyboard_rows.append(_CANCEL_SEARCH_ROW)
     reply_markup = InlineKeyboardMarkup(keyboard_rows)
     
-    final_text = response_text_header + "\nClick a song from the list above to download its audio:"
+    response_parts.append("\nClick a song from the list above to download its audio:")
+    final_text = "".join(response_parts)
     await context.bot.send_message(chat_id=target_chat_id, text=final_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
@@ -1334,31 +2022,38 @@ async def auto_download_first_result(
 
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-
-    if user_id in active_downloads:
+    # Bind the hot attribute chains once: bot calls and the callback message
+    # id are referenced repeatedly below.
+    bot = context.bot
+    cbq = update.callback_query
+    cbq_msg_id = cbq.message.message_id if (cbq and cbq.message) else None
+
+    dl_lock = _download_lock_for(user_id)
+    if dl_lock.locked():
         message_text = "Hold on! You already have a download in progress. Let that finish first. 😊"
         if original_message_id_to_edit: # Coming from a button press
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=original_message_id_to_edit, text=message_text, reply_markup=None, parse_mode=ParseMode.HTML)
+            await bot.edit_message_text(chat_id=chat_id, message_id=original_message_id_to_edit, text=message_text, reply_markup=None, parse_mode=ParseMode.HTML)
         elif original_message_to_reply_to: # Coming from a command
-             await context.bot.send_message(chat_id=chat_id, text=message_text, reply_to_message_id=original_message_to_reply_to, parse_mode=ParseMode.HTML)
+             await bot.send_message(chat_id=chat_id, text=message_text, reply_to_message_id=original_message_to_reply_to, parse_mode=ParseMode.HTML)
         else: # Fallback
-             await context.bot.send_message(chat_id=chat_id, text=message_text, parse_mode=ParseMode.HTML)
+             await bot.send_message(chat_id=chat_id, text=message_text, parse_mode=ParseMode.HTML)
         return
 
-    active_downloads.add(user_id)
+    await dl_lock.acquire()
     status_msg = None 
+    dl_task = None
 
     try:
         # Determine initial status message action (edit or send new)
         search_status_text = f"🔍 Okay, searching for '<i>{query}</i>' to download..."
         if original_message_id_to_edit:
-            status_msg = await context.bot.edit_message_text(chat_id=chat_id, message_id=original_message_id_to_edit, 
+            status_msg = await bot.edit_message_text(chat_id=chat_id, message_id=original_message_id_to_edit, 
                                              text=search_status_text, parse_mode=ParseMode.HTML, reply_markup=None)
         elif original_message_to_reply_to: # If called from /autodownload
-            status_msg = await context.bot.send_message(chat_id=chat_id, text=search_status_text, 
+            status_msg = await bot.send_message(chat_id=chat_id, text=search_status_text, 
                                              reply_to_message_id=original_message_to_reply_to, parse_mode=ParseMode.HTML)
         else: # Fallback if no specific message to edit/reply to
-            status_msg = await context.bot.send_message(chat_id=chat_id, text=search_status_text, parse_mode=ParseMode.HTML)
+            status_msg = await bot.send_message(chat_id=chat_id, text=search_status_text, parse_mode=ParseMode.HTML)
 
         # Search for the track. If query is already a URL, search_youtube_sync might directly use it or search with it.
         # If query is an ID, it needs to be formatted as URL for download_youtube_audio_sync below.
@@ -1367,25 +2062,29 @@ async def auto_download_first_result(
 
         if is_valid_youtube_url(query): # Query is already a URL (e.g., from button click with direct URL)
             video_url_to_download = query
-            # Attempt to get title for better status message
+            # Start the download immediately and fetch the title for the
+            # status message while it runs - both hit YouTube, and the
+            # metadata round trip otherwise delays the download start.
+            dl_task = asyncio.create_task(download_youtube_audio(video_url_to_download))
             try:
-                temp_info = await asyncio.to_thread(yt_dlp.YoutubeDL({'quiet':True, 'no_warnings':True}).extract_info, query, download=False)
-                if temp_info and temp_info.get('title'):
-                    video_title_for_status = temp_info.get('title', query)
+                prefetched_title = await _prefetch_title(query)
+                if prefetched_title:
+                    video_title_for_status = prefetched_title
             except Exception:
                 logger.debug(f"Could not pre-fetch title for URL {query} in auto-DL, using URL as title.")
         else: # Query is a search term
-            results = await asyncio.to_thread(search_youtube_sync, query, max_results=1) 
+            results = await search_youtube(query, max_results=1) 
             if not results or not results[0].get('url') or not is_valid_youtube_url(results[0]['url']):
                 await status_msg.edit_text(f"❌ Oops! Couldn't find a downloadable track for '<i>{query}</i>'. Maybe try <code>/search {query}</code> for more options?", parse_mode=ParseMode.HTML)
                 return
             top_result = results[0]
             video_url_to_download = top_result["url"]
             video_title_for_status = top_result.get("title", query)
+            dl_task = asyncio.create_task(download_youtube_audio(video_url_to_download))
         
         await status_msg.edit_text(f"✅ Found: <b>{video_title_for_status}</b>.\n⏳ Preparing download... (this can take a moment!)", parse_mode=ParseMode.HTML)
 
-        download_result = await asyncio.to_thread(download_youtube_audio_sync, video_url_to_download)
+        download_result = await dl_task
         
         if not download_result["success"]:
             error_message = download_result.get('error', 'Unknown download error.')
@@ -1395,26 +2094,17 @@ async def auto_download_first_result(
         await status_msg.edit_text(f"✅ Downloaded: <b>{download_result['title']}</b>.\n✅ Sending the audio file now...", parse_mode=ParseMode.HTML)
         
         await send_audio_via_bot(
-            bot=context.bot,
+            bot=bot,
             chat_id=chat_id,
             audio_path=download_result["audio_path"],
             title=download_result["title"],
             performer=download_result.get("artist"),
             caption=f"🎵 Here's your track: <b>{download_result['title']}</b>",
             duration=download_result.get("duration"),
-            reply_to_message_id= original_message_to_reply_to or (update.callback_query and update.callback_query.message.message_id if update.callback_query else None) or status_msg.message_id
+            reply_to_message_id= original_message_to_reply_to or cbq_msg_id or status_msg.message_id
         )
 
-        if os.path.exists(download_result["audio_path"]):
-            try:
-                os.remove(download_result["audio_path"])
-                logger.info(f"Temp file deleted after auto-DL: {download_result['audio_path']} (user {user_id})")
-            except OSError as e:
-                logger.error(f"Error deleting temp file (auto-DL) {download_result['audio_path']} (user {user_id}): {e}")
-        
-        try:
-            await status_msg.delete() # Clean up the final status message
-        except Exception: pass # It might have already been deleted or other issues
+        await _cleanup_after_send(status_msg, download_result["audio_path"])
     
     except (TimedOut, NetworkError) as net_err:
         logger.error(f"Telegram API/Network error during auto-download (user {user_id}, query '{query}'): {net_err}")
@@ -1427,117 +2117,151 @@ async def auto_download_first_result(
             try: await status_msg.edit_text(f"❌ An unexpected error occurred while processing '<i>{query}</i>'. My apologies! Please try again.", parse_mode=ParseMode.HTML)
             except: pass # Ignore error editing if message is gone
     finally:
-        active_downloads.discard(user_id)
+        # Reap the background download before the lock releases: if a status
+        # edit raised above, the task would otherwise keep yt-dlp running
+        # (and its temp file on disk) with the per-user lock already free.
+        if dl_task is not None:
+            if not dl_task.done():
+                dl_task.cancel()
+            try:
+                leftover = await dl_task
+                if leftover.get("success") and leftover.get("audio_path"):
+                    _enqueue_file_cleanup(leftover["audio_path"])
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                pass  # Failure was already reported (or superseded) above.
+        dl_lock.release()
+
 
+async def _cb_set_mood(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, payload: str) -> Union[int, None]:
+    mood = payload
+    user_contexts[user_id]["mood"] = mood
+    user_moods[user_id] = mood
+    mark_contexts_dirty()
+    logger.info(f"User {user_id} set mood via button to: {mood}")
+
+    await query.edit_message_text(
+        f"Got it, {query.from_user.first_name}! You're feeling <b>{mood}</b>. 🎶\nAny particular genre you'd like for music recommendations now, or should I just go by mood?",
+        reply_markup=_PREF_KEYBOARD,
+        parse_mode=ParseMode.HTML
+    )
+    return PREFERENCE
+
+async def _cb_set_preference(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, payload: str) -> Union[int, None]:
+    preference = payload
+    msg_text = ""
+    if preference == "skip" or preference == "any":
+        user_contexts[user_id]["preferences"] = [] # Clear specific genre preferences
+        msg_text = "Alright! I'll keep your mood in mind for recommendations."
+    else:
+        user_contexts[user_id]["preferences"] = [preference] # Set this specific genre
+        msg_text = f"Great choice! <b>{preference.capitalize()}</b> it is. "
+    mark_contexts_dirty()
+    logger.info(f"User {user_id} set preference via button to: {preference}")
+
+    msg_text += "\n\nYou can now:\n➡️ Try `/recommend` for tailored suggestions.\n➡️ Use `/search [song name]` to find specific tracks.\n➡️ Or just continue chatting with me!"
+    await query.edit_message_text(msg_text, parse_mode=ParseMode.HTML)
+    return ConversationHandler.END
+
+async def _cb_download_selected(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, payload: str) -> Union[int, None]:
+    # Download chosen from a list of search results
+    video_id = payload
+    if not _YT_ID_EXACT_RE.match(video_id):
+         logger.error(f"Invalid YouTube ID '{video_id}' from CB_DOWNLOAD_PREFIX button (user {user_id}).")
+         await query.edit_message_text("❌ Error: Invalid video ID provided. Please try searching again.", reply_markup=None)
+         return None
+
+    youtube_direct_url = f"https://www.youtube.com/watch?v={video_id}"
+    # original_message_id_to_edit is the message with the search result buttons
+    await auto_download_first_result(update, context, query=youtube_direct_url, original_message_id_to_edit=query.message.message_id if query.message else None)
+    return None
+
+async def _cb_auto_download(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, payload: str) -> Union[int, None]:
+    # From "Yes, download [this specific track]" type buttons
+    video_id_or_query = payload
+
+    target_url_for_auto_dl = ""
+    if _YT_ID_EXACT_RE.match(video_id_or_query): # It's a video ID
+        target_url_for_auto_dl = f"https://www.youtube.com/watch?v={video_id_or_query}"
+    else: # It's a query string (less likely from this specific prefix now, but good to handle)
+        target_url_for_auto_dl = video_id_or_query # auto_download_first_result handles search then download
+
+    # original_message_id_to_edit is the message with "Download X or show more options?"
+    await auto_download_first_result(update, context, query=target_url_for_auto_dl, original_message_id_to_edit=query.message.message_id if query.message else None)
+    return None
+
+async def _cb_show_options(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, payload: str) -> Union[int, None]:
+    # User clicked "Show more options"
+    search_query_str = payload
+    if not search_query_str:
+        logger.warning(f"CB_SHOW_OPTIONS_PREFIX (user {user_id}): Original query missing from callback data.")
+        await query.edit_message_text("Cannot show options, the original search query was lost. Please try searching again with `/search`.", reply_markup=None)
+        return None
+
+    # Edit the current message ("I found X, download or show options?") to "Searching..."
+    await query.edit_message_text(f"🔍 Okay, fetching more YouTube options for '<i>{search_query_str}</i>'...", parse_mode=ParseMode.HTML, reply_markup=None)
+
+    results = await search_youtube(search_query_str, max_results=5)
+
+    # We want send_search_results to send a *new* message with the list, not edit.
+    # The original query.message (the "Download X or more options?" one) effectively gets replaced by the search results list.
+    # send_search_results needs an Update-like object; the `update` object from the callback query handler is fine.
+    # It will use update.effective_chat.id to send the new message.
+    await send_search_results(update, search_query_str, results)
+    return None
+
+async def _cb_cancel_search(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, payload: str) -> Union[int, None]:
+    await query.edit_message_text("❌ Search cancelled. Feel free to try another search or command!", reply_markup=None)
+    return None
+
+async def _cb_cancel_spotify(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, payload: str) -> Union[int, None]:
+    # This callback should ideally only be handled by the spotify_conv_handler's fallback or state handler.
+    # If it reaches here, it means it wasn't caught by the ConversationHandler.
+    # This could happen if the conversation timed out but the button was still active.
+    logger.info(f"CB_CANCEL_SPOTIFY (user {user_id}) handled by general button handler (likely outside active conversation).")
+    await query.edit_message_text("Spotify linking cancelled. You can use /link_spotify to try again anytime.", reply_markup=None)
+    # Return END to ensure any stray conversation context (if any) is terminated.
+    return ConversationHandler.END
+
+# Table-driven callback dispatch: exact matches are one dict probe, prefixed
+# payloads are at most one probe per distinct prefix length - no O(k)
+# startswith chain per button press.
+_CB_EXACT_DISPATCH = {
+    CB_CANCEL_SEARCH: _cb_cancel_search,
+    CB_CANCEL_SPOTIFY: _cb_cancel_spotify,
+}
+_CB_PREFIX_DISPATCH = {
+    CB_MOOD_PREFIX: _cb_set_mood,
+    CB_PREFERENCE_PREFIX: _cb_set_preference,
+    CB_DOWNLOAD_PREFIX: _cb_download_selected,
+    CB_AUTO_DOWNLOAD_PREFIX: _cb_auto_download,
+    CB_SHOW_OPTIONS_PREFIX: _cb_show_options,
+}
+_CB_PREFIX_LENGTHS = tuple(sorted({len(p) for p in _CB_PREFIX_DISPATCH}, reverse=True))
 
 async def enhanced_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Union[int, None]:
-    """Handle button callbacks from inline keyboards."""
+    """Handle button callbacks from inline keyboards via the dispatch tables."""
     query = update.callback_query
     if not query or not query.from_user: return None # Should not happen
-    await query.answer() 
-    
+    await query.answer()
+
     data = query.data
     user_id = query.from_user.id
-    user_contexts.setdefault(user_id, {"mood": None, "preferences": [], "conversation_history": [], "spotify": {}})
-    
-    logger.debug(f"Button callback: '{data}' for user {user_id} (message_id: {query.message.message_id if query.message else 'N/A'})")
-
-    if data.startswith(CB_MOOD_PREFIX):
-        mood = data[len(CB_MOOD_PREFIX):]
-        user_contexts[user_id]["mood"] = mood
-        logger.info(f"User {user_id} set mood via button to: {mood}")
-
-        keyboard = [ 
-            [InlineKeyboardButton("Pop", callback_data=f"{CB_PREFERENCE_PREFIX}pop"),
-             InlineKeyboardButton("Rock", callback_data=f"{CB_PREFERENCE_PREFIX}rock"),
-             InlineKeyboardButton("Hip-Hop", callback_data=f"{CB_PREFERENCE_PREFIX}hiphop")],
-            [InlineKeyboardButton("Electronic", callback_data=f"{CB_PREFERENCE_PREFIX}electronic"),
-             InlineKeyboardButton("Classical", callback_data=f"{CB_PREFERENCE_PREFIX}classical"),
-             InlineKeyboardButton("Jazz", callback_data=f"{CB_PREFERENCE_PREFIX}jazz")],
-            [InlineKeyboardButton("Folk/Acoustic", callback_data=f"{CB_PREFERENCE_PREFIX}folk"), # Changed slightly
-             InlineKeyboardButton("R&B/Soul", callback_data=f"{CB_PREFERENCE_PREFIX}rnb"), # Changed slightly
-             InlineKeyboardButton("Any/Surprise Me!", callback_data=f"{CB_PREFERENCE_PREFIX}any")],
-            [InlineKeyboardButton("➡️ Skip Genre / Use Mood Only", callback_data=f"{CB_PREFERENCE_PREFIX}skip")],
-        ]
-        await query.edit_message_text(
-            f"Got it, {query.from_user.first_name}! You're feeling <b>{mood}</b>. 🎶\nAny particular genre you'd like for music recommendations now, or should I just go by mood?",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode=ParseMode.HTML
-        )
-        return PREFERENCE 
-
-    elif data.startswith(CB_PREFERENCE_PREFIX):
-        preference = data[len(CB_PREFERENCE_PREFIX):]
-        msg_text = ""
-        if preference == "skip" or preference == "any":
-            user_contexts[user_id]["preferences"] = [] # Clear specific genre preferences
-            msg_text = "Alright! I'll keep your mood in mind for recommendations."
-        else:
-            user_contexts[user_id]["preferences"] = [preference] # Set this specific genre
-            msg_text = f"Great choice! <b>{preference.capitalize()}</b> it is. "
-        logger.info(f"User {user_id} set preference via button to: {preference}")
-        
-        msg_text += "\n\nYou can now:\n➡️ Try `/recommend` for tailored suggestions.\n➡️ Use `/search [song name]` to find specific tracks.\n➡️ Or just continue chatting with me!"
-        await query.edit_message_text(msg_text, parse_mode=ParseMode.HTML)
-        return ConversationHandler.END 
-
-    elif data.startswith(CB_DOWNLOAD_PREFIX): # Download chosen from a list of search results
-        video_id = data[len(CB_DOWNLOAD_PREFIX):]
-        if not re.match(r'^[0-9A-Za-z_-]{11}$', video_id):
-             logger.error(f"Invalid YouTube ID '{video_id}' from CB_DOWNLOAD_PREFIX button (user {user_id}).")
-             await query.edit_message_text("❌ Error: Invalid video ID provided. Please try searching again.", reply_markup=None)
-             return None
-        
-        youtube_direct_url = f"https://www.youtube.com/watch?v={video_id}"
-        # original_message_id_to_edit is the message with the search result buttons
-        await auto_download_first_result(update, context, query=youtube_direct_url, original_message_id_to_edit=query.message.message_id if query.message else None)
-        return None 
+    cbq_msg_id = query.message.message_id if query.message else None
+    user_contexts[user_id]  # defaultdict: allocates only on first sight
 
-    elif data.startswith(CB_AUTO_DOWNLOAD_PREFIX): # From "Yes, download [this specific track]" type buttons
-        video_id_or_query = data[len(CB_AUTO_DOWNLOAD_PREFIX):] 
-        
-        target_url_for_auto_dl = ""
-        if re.match(r'^[0-9A-Za-z_-]{11}$', video_id_or_query): # It's a video ID
-            target_url_for_auto_dl = f"https://www.youtube.com/watch?v={video_id_or_query}"
-        else: # It's a query string (less likely from this specific prefix now, but good to handle)
-            target_url_for_auto_dl = video_id_or_query # auto_download_first_result handles search then download
-
-        # original_message_id_to_edit is the message with "Download X or show more options?"
-        await auto_download_first_result(update, context, query=target_url_for_auto_dl, original_message_id_to_edit=query.message.message_id if query.message else None)
-        return None
+    logger.debug("Button callback: '%s' for user %s (message_id: %s)", data, user_id, cbq_msg_id if cbq_msg_id is not None else "N/A")
 
-    elif data.startswith(CB_SHOW_OPTIONS_PREFIX): # User clicked "Show more options"
-        search_query_str = data[len(CB_SHOW_OPTIONS_PREFIX):]
-        if not search_query_str:
-            logger.warning(f"CB_SHOW_OPTIONS_PREFIX (user {user_id}): Original query missing from callback data.")
-            await query.edit_message_text("Cannot show options, the original search query was lost. Please try searching again with `/search`.", reply_markup=None)
-            return None
-        
-        # Edit the current message ("I found X, download or show options?") to "Searching..."
-        await query.edit_message_text(f"🔍 Okay, fetching more YouTube options for '<i>{search_query_str}</i>'...", parse_mode=ParseMode.HTML, reply_markup=None)
-        
-        results = await asyncio.to_thread(search_youtube_sync, search_query_str, max_results=5)
-        
-        # We want send_search_results to send a *new* message with the list, not edit.
-        # The original query.message (the "Download X or more options?" one) effectively gets replaced by the search results list.
-        # send_search_results needs an Update-like object; the `update` object from the callback query handler is fine.
-        # It will use update.effective_chat.id to send the new message.
-        await send_search_results(update, search_query_str, results)
-        return None
+    handler = _CB_EXACT_DISPATCH.get(data)
+    if handler is not None:
+        return await handler(update, context, query, user_id, "")
+    for prefix_len in _CB_PREFIX_LENGTHS:
+        handler = _CB_PREFIX_DISPATCH.get(data[:prefix_len])
+        if handler is not None:
+            return await handler(update, context, query, user_id, data[prefix_len:])
 
-    elif data == CB_CANCEL_SEARCH:
-        await query.edit_message_text("❌ Search cancelled. Feel free to try another search or command!", reply_markup=None)
-        return None
-    elif data == CB_CANCEL_SPOTIFY: 
-        # This callback should ideally only be handled by the spotify_conv_handler's fallback or state handler.
-        # If it reaches here, it means it wasn't caught by the ConversationHandler.
-        # This could happen if the conversation timed out but the button was still active.
-        logger.info(f"CB_CANCEL_SPOTIFY (user {user_id}) handled by general button handler (likely outside active conversation).")
-        await query.edit_message_text("Spotify linking cancelled. You can use /link_spotify to try again anytime.", reply_markup=None)
-        # Return END to ensure any stray conversation context (if any) is terminated.
-        return ConversationHandler.END 
-
-    logger.warning(f"Unhandled callback data: '{data}' from user {user_id} (message_id: {query.message.message_id if query.message else 'N/A'})")
+    logger.warning(f"Unhandled callback data: '{data}' from user {user_id} (message_id: {cbq_msg_id if cbq_msg_id is not None else 'N/A'})")
     try:
         await query.edit_message_text("Sorry, there was an issue with that button or the action has expired.", reply_markup=None)
     except Exception as e_edit:
@@ -1552,42 +2276,37 @@ async def enhanced_handle_message(update: Update, context: ContextTypes.DEFAULT_
 
     user_id = update.effective_user.id
     text = update.message.text.strip()
-    logger.debug(f"Received message from user {user_id}: '{text[:100]}...'")
+    logger.debug("Received message from user %s: '%.100s...'", user_id, text)
 
-    user_contexts.setdefault(user_id, {"mood": None, "preferences": [], "conversation_history": [], "spotify": {}})
+    user_contexts[user_id]  # defaultdict: allocates only on first sight
 
     # 1. Direct YouTube URL for Download
     if is_valid_youtube_url(text):
-        logger.info(f"User {user_id} sent a YouTube URL directly: {text}")
+        logger.info("User %s sent a YouTube URL directly: %s", user_id, text)
         # Pass the update directly to download_music, it will extract the URL
         # download_music handles creating its own context.args if needed from update.message.text
         await download_music(update, context)
         return
 
-    # 2. AI-based Mood Detection (passive, for context)
-    # Only run on messages with a few words to avoid over-processing short interactions.
-    if len(text.split()) > 3: 
-        current_mood = user_contexts[user_id].get("mood", "neutral")
-        # Schedule mood detection, don't await it here to keep message flow fast
-        async def _update_mood():
-            detected_mood = await detect_mood_from_text(user_id, text)
-            if detected_mood and detected_mood != "neutral" and detected_mood != current_mood :
-                user_contexts[user_id]["mood"] = detected_mood
-                logger.info(f"Passive mood update for user {user_id} to: {detected_mood} (was: {current_mood}) based on: '{text[:30]}'")
-        asyncio.create_task(_update_mood())
-
-
-    # 3. AI Music Request Detection (e.g., "play song X", "download Y by Z")
-    ai_music_eval = await is_music_request(user_id, text)
+    # 2+3. One fused AI call covers passive mood detection and music-request
+    # detection - previously two sequential round trips.
+    ai_music_eval = await analyze_message(user_id, text)
+    current_mood = user_moods.get(user_id, "neutral")
+    detected_mood = ai_music_eval.get("mood")
+    if detected_mood and detected_mood != "neutral" and detected_mood != current_mood:
+        user_contexts[user_id]["mood"] = detected_mood
+        user_moods[user_id] = detected_mood
+        mark_contexts_dirty()
+        logger.info("Passive mood update for user %s to: %s (was: %s) based on: '%.30s'", user_id, detected_mood, current_mood, text)
     if ai_music_eval.get("is_music_request") and ai_music_eval.get("song_query"):
         music_query = ai_music_eval["song_query"]
         # User explicitly asked for music by name. Offer to download first result or show options.
         status_msg = await update.message.reply_text(f"🎵 You're looking for '<i>{music_query}</i>'? Let me check YouTube for that...", parse_mode=ParseMode.HTML)
         
         # Search YouTube for the top result
-        results = await asyncio.to_thread(search_youtube_sync, music_query, max_results=1)
+        results = await search_youtube(music_query, max_results=1)
         
-        if results and results[0].get('id') and re.match(r'^[0-9A-Za-z_-]{11}$', results[0]['id']):
+        if results and results[0].get('id') and _YT_ID_EXACT_RE.match(results[0]['id']):
             top_res = results[0]
             title = top_res.get('title', 'this track')
             uploader = top_res.get('uploader', 'Unknown Artist')
@@ -1615,17 +2334,10 @@ async def enhanced_handle_message(update: Update, context: ContextTypes.DEFAULT_
 
     # 4. Heuristic Lyrics Request Detection (e.g., "lyrics for X", "what are the lyrics to Y")
     # This is a simpler, non-AI check for common lyrics phrases.
-    lyrics_keywords_precise = ["lyrics for", "lyrics to", "get lyrics for", "find lyrics for", "what are the lyrics to", "song lyrics for"]
-    lyrics_query_candidate = None
-    text_lower = text.lower()
-    for keyword in lyrics_keywords_precise:
-        if text_lower.startswith(keyword):
-            # Extract text after the keyword
-            potential_query = text[len(keyword):].strip()
-            if potential_query: # Ensure there's something after the keyword
-                lyrics_query_candidate = potential_query
-                logger.info(f"Heuristic lyrics request detected for user {user_id}: '{lyrics_query_candidate}' (full text: '{text_lower}')")
-                break
+    lyrics_match = _LYRICS_PREFIX_RE.match(text)
+    lyrics_query_candidate = lyrics_match.group(1).strip() if lyrics_match else None
+    if lyrics_query_candidate:
+        logger.info("Heuristic lyrics request detected for user %s: '%s'", user_id, lyrics_query_candidate)
     
     if lyrics_query_candidate:
         # Pass the extracted query to the /lyrics command handler logic
@@ -1642,7 +2354,7 @@ async def enhanced_handle_message(update: Update, context: ContextTypes.DEFAULT_
     # 5. Fallback to General AI Chat
     # Show a "thinking" message for a better UX, as AI can take a moment
     # Random small delay can make it feel more natural than instant "thinking"
-    await asyncio.sleep(0.1 + (os.urandom(1)[0] / 255.0) * 0.3) # Delay 0.1 to 0.4s
+    await asyncio.sleep(0.1 + random.random() * 0.3) # Delay 0.1 to 0.4s
     typing_msg = await update.message.reply_text("<i>MelodyMind is thinking...</i> 🎶", parse_mode=ParseMode.HTML)
     try:
         response_text = await generate_chat_response(user_id, text)
@@ -1663,7 +2375,7 @@ async def clear_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     cleared = False
     if user_id in user_contexts:
         if "conversation_history" in user_contexts[user_id] and user_contexts[user_id]["conversation_history"]:
-            user_contexts[user_id]["conversation_history"] = []
+            user_contexts[user_id]["conversation_history"].clear()
             cleared = True
         # Optionally, clear mood and preferences too, or keep them. For now, just history.
         # user_contexts[user_id]["mood"] = None
@@ -1692,7 +2404,57 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # context.user_data.pop('some_temp_conv_state', None)
     return ConversationHandler.END
 
+# Exact-match cache for analyze_conversation: repeated /recommend calls with
+# unchanged history/Spotify state hash to the same key and skip the LLM.
+# Same insertion-ordered TTL-dict shape as the mood cache.
+_ANALYSIS_CACHE_TTL = 600
+_ANALYSIS_CACHE_MAX = 512
+_analysis_cache: Dict[bytes, Tuple[Dict, float]] = {}
+
+def _analysis_cache_get(key: bytes) -> Optional[Dict]:
+    entry = _analysis_cache.get(key)
+    if entry and time.monotonic() < entry[1]:
+        return entry[0]
+    if entry:
+        del _analysis_cache[key]
+    return None
+
+def _analysis_cache_put(key: bytes, value: Dict) -> None:
+    if len(_analysis_cache) >= _ANALYSIS_CACHE_MAX:
+        del _analysis_cache[next(iter(_analysis_cache))]
+    _analysis_cache[key] = (value, time.monotonic() + _ANALYSIS_CACHE_TTL)
+
+# Coalesce concurrent analyses for the same user: a double-tapped /recommend
+# awaits the in-flight task instead of issuing a second completion. True
+# cross-user batching (one multi-user prompt) is deliberately not done - it
+# mixes users' data into one prompt and degrades per-user answer quality.
+_inflight_conv_analysis: Dict[int, "asyncio.Task"] = {}
+
+def _user_ctx(user_id: int) -> Dict:
+    """Return the user's context with the Spotify sub-keys initialized.
+
+    One call replaces the repeated setdefault/get chains - the factory
+    covers mood/preferences/history, this fills in the Spotify lists.
+    """
+    ctx = user_contexts[user_id]
+    spotify = ctx.setdefault("spotify", {})
+    spotify.setdefault("recently_played", [])
+    spotify.setdefault("top_tracks", [])
+    return ctx
+
 async def analyze_conversation(user_id: int) -> Dict:
+    """Deduplicating front door for _analyze_conversation_impl."""
+    pending = _inflight_conv_analysis.get(user_id)
+    if pending is not None:
+        return await pending
+    task = asyncio.ensure_future(_analyze_conversation_impl(user_id))
+    _inflight_conv_analysis[user_id] = task
+    try:
+        return await task
+    finally:
+        _inflight_conv_analysis.pop(user_id, None)
+
+async def _analyze_conversation_impl(user_id: int) -> Dict:
     """Analyze conversation history and Spotify data using AI for preferences."""
     default_return = {"genres": user_contexts.get(user_id, {}).get("preferences", []), 
                       "artists": [], 
@@ -1701,12 +2463,7 @@ async def analyze_conversation(user_id: int) -> Dict:
         logger.warning(f"OpenAI client not available for analyze_conversation (user {user_id}).")
         return default_return
 
-    # Ensure necessary keys exist in user_contexts
-    user_ctx = user_contexts.setdefault(user_id, {})
-    user_ctx.setdefault("preferences", [])
-    user_ctx.setdefault("conversation_history", [])
-    user_ctx.setdefault("spotify", {}).setdefault("recently_played", [])
-    user_ctx["spotify"].setdefault("top_tracks", [])
+    user_ctx = _user_ctx(user_id)
 
     # Require some data to be present for meaningful analysis
     if len(user_ctx["conversation_history"]) < 2 and \
@@ -1720,28 +2477,36 @@ async def analyze_conversation(user_id: int) -> Dict:
     logger.info(f"Performing AI conversation/data analysis for user {user_id}")
     try:
         # Summarize conversation history (last few exchanges)
-        history_summary_parts = [f"{msg['role']}: {msg['content'][:100]}" for msg in user_ctx["conversation_history"][-6:]] # Limit chars per message
-        conversation_text_summary = "\n".join(history_summary_parts) if history_summary_parts else "No conversation history."
+        # Summary strings are invalidated on write (history append, Spotify
+        # refresh) and rebuilt at most once between writes - steady-state
+        # /recommend calls reuse the cached strings instead of re-slicing.
+        cached_summaries = None if user_ctx.pop("_summary_dirty", False) else user_ctx.get("_summary_cache")
+        if cached_summaries is not None:
+            conversation_text_summary, spotify_summary = cached_summaries
+        else:
+            history_summary_parts = [f"{msg['role']}: {msg['content'][:100]}" for msg in list(user_ctx["conversation_history"])[-6:]] # Limit chars per message
+            conversation_text_summary = "\n".join(history_summary_parts) if history_summary_parts else "No conversation history."
 
-        # Summarize Spotify data
-        spotify_summary_parts = []
-        if user_ctx["spotify"]["recently_played"]:
-            try:
-                tracks = user_ctx["spotify"]["recently_played"]
-                rp_summary = ", ".join(
-                    [f"'{item['track']['name'][:30]}' by {item['track']['artists'][0]['name'][:20]}" for item in tracks[:3] if item.get("track")] 
-                )
-                if rp_summary: spotify_summary_parts.append("Recently played: " + rp_summary)
-            except Exception as e_rp: logger.debug(f"Error summarizing recently_played for AI (user {user_id}): {e_rp}")
-        if user_ctx["spotify"]["top_tracks"]:
-            try:
-                tracks = user_ctx["spotify"]["top_tracks"]
-                tt_summary = ", ".join(
-                    [f"'{item['name'][:30]}' by {item['artists'][0]['name'][:20]}" for item in tracks[:3] if item.get("artists")]
-                )
-                if tt_summary: spotify_summary_parts.append("Top tracks: " + tt_summary)
-            except Exception as e_tt: logger.debug(f"Error summarizing top_tracks for AI (user {user_id}): {e_tt}")
-        spotify_summary = ". ".join(spotify_summary_parts) if spotify_summary_parts else "No Spotify data."
+            # Summarize Spotify data
+            spotify_summary_parts = []
+            if user_ctx["spotify"]["recently_played"]:
+                try:
+                    tracks = user_ctx["spotify"]["recently_played"]
+                    rp_summary = ", ".join(
+                        [f"'{item['track']['name'][:30]}' by {item['track']['artists'][0]['name'][:20]}" for item in tracks[:3] if item.get("track")] 
+                    )
+                    if rp_summary: spotify_summary_parts.append("Recently played: " + rp_summary)
+                except Exception as e_rp: logger.debug(f"Error summarizing recently_played for AI (user {user_id}): {e_rp}")
+            if user_ctx["spotify"]["top_tracks"]:
+                try:
+                    tracks = user_ctx["spotify"]["top_tracks"]
+                    tt_summary = ", ".join(
+                        [f"'{item['name'][:30]}' by {item['artists'][0]['name'][:20]}" for item in tracks[:3] if item.get("artists")]
+                    )
+                    if tt_summary: spotify_summary_parts.append("Top tracks: " + tt_summary)
+                except Exception as e_tt: logger.debug(f"Error summarizing top_tracks for AI (user {user_id}): {e_tt}")
+            spotify_summary = ". ".join(spotify_summary_parts) if spotify_summary_parts else "No Spotify data."
+            user_ctx["_summary_cache"] = (conversation_text_summary, spotify_summary)
         
         prompt_user_content = (
             f"Conversation Snippets:\n{conversation_text_summary}\n\n"
@@ -1749,6 +2514,15 @@ async def analyze_conversation(user_id: int) -> Dict:
             f"User's explicitly set current mood: {user_ctx.get('mood', 'Not set')}\n"
             f"User's explicitly set genre preferences: {', '.join(user_ctx.get('preferences',[])) if user_ctx.get('preferences') else 'Not set'}"
         )
+
+        # Identical inputs produce an identical analysis: hash the fully
+        # canonicalized prompt content and reuse a recent result instead of
+        # paying a 400-800 ms completion for idle repeats.
+        analysis_key = hashlib.blake2b(prompt_user_content.encode(), digest_size=16).digest()
+        cached_analysis = _analysis_cache_get(analysis_key)
+        if cached_analysis is not None:
+            logger.info(f"AI analysis cache hit for user {user_id}")
+            return cached_analysis
         prompt_messages = [
             {"role": "system", "content": 
                 "Analyze the user's recent chat messages, Spotify listening habits, and explicitly set mood/preferences. "
@@ -1760,8 +2534,7 @@ async def analyze_conversation(user_id: int) -> Dict:
             {"role": "user", "content": prompt_user_content }
         ]
 
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
+        response = await client.chat.completions.create(
             model="gpt-3.5-turbo-0125", # JSON mode capable
             messages=prompt_messages,
             max_tokens=150, 
@@ -1770,7 +2543,7 @@ async def analyze_conversation(user_id: int) -> Dict:
         )
 
         result_str = response.choices[0].message.content
-        result = json.loads(result_str)
+        result = _json_loads(result_str)
 
         if not isinstance(result, dict):
             logger.error(f"AI analysis (user {user_id}) returned non-dict: {result_str}")
@@ -1786,16 +2559,17 @@ async def analyze_conversation(user_id: int) -> Dict:
 
         inferred_mood_raw = result.get("mood")
         inferred_mood = None
-        if isinstance(inferred_mood_raw, str) and inferred_mood_raw.strip().lower() not in ["null", "none", ""]:
-            valid_moods_ai = ["happy", "sad", "anxious", "excited", "calm", "angry", "neutral", "energetic", "relaxed", "focused", "nostalgic"]
-            if inferred_mood_raw.lower() in valid_moods_ai:
+        if isinstance(inferred_mood_raw, str) and inferred_mood_raw.strip().lower() not in ("null", "none", ""):
+            if inferred_mood_raw.lower() in _VALID_MOOD_SET:
                 inferred_mood = inferred_mood_raw.lower()
         
         # Update user_contexts based on AI analysis, potentially overriding or augmenting existing.
         # Give preference to user's explicit settings if AI is very different or unsure.
         # For this iteration, let's merge: use AI if user hasn't set, or if AI has high confidence (not modeled here).
         # Simple merge: If AI found genres and user has none, use AI's. If AI found mood and user has none, use AI's.
-        final_genres = list(set(user_ctx.get("preferences", []) + inferred_genres[:2])) # Combine and keep unique, max 2 from AI
+        # dict.fromkeys dedupes while preserving order - set() made the [:2]
+        # slice below nondeterministic and cost an extra allocation.
+        final_genres = list(dict.fromkeys((user_ctx.get("preferences") or []) + inferred_genres[:2]))
         final_mood = user_ctx.get("mood") or inferred_mood or "neutral" # Prioritize user's explicit mood
         
         # Don't directly modify user_contexts['preferences'] or ['mood'] here; this function is for analysis.
@@ -1807,9 +2581,10 @@ async def analyze_conversation(user_id: int) -> Dict:
             "mood": final_mood
         }
         logger.info(f"AI analysis (user {user_id}) completed. Result: {analyzed_data}")
+        _analysis_cache_put(analysis_key, analyzed_data)
         return analyzed_data
 
-    except json.JSONDecodeError as jde:
+    except ValueError as jde:  # json.JSONDecodeError / orjson.JSONDecodeError
         logger.error(f"AI analysis JSON decode error (user {user_id}): {jde}. Raw output: {response.choices[0].message.content if 'response' in locals() and response.choices else 'N/A'}")
     except Exception as e:
         logger.error(f"Error in AI analyze_conversation for user {user_id}: {e}", exc_info=True)
@@ -1827,18 +2602,45 @@ async def smart_recommend_music(update: Update, context: ContextTypes.DEFAULT_TY
 
     try:
         # Refresh Spotify data if linked, non-blocking to initial analysis
+        user_ctx = _user_ctx(user_id)
+        spotify_ctx = user_ctx["spotify"]
         async def _fetch_spotify_data():
-            if user_contexts.get(user_id, {}).get("spotify", {}).get("access_token"): 
+            if spotify_ctx.get("access_token"):
                 logger.info(f"Fetching latest Spotify data (user {user_id}) for smart recommendations.")
                 rp_task = get_user_spotify_data(user_id, "player/recently-played", params={"limit": 5})
                 tt_task = get_user_spotify_data(user_id, "top/tracks", params={"limit": 5, "time_range": "short_term"})
                 recently_played_data, top_tracks_data = await asyncio.gather(rp_task, tt_task)
-                if recently_played_data: user_contexts.setdefault(user_id, {}).setdefault("spotify", {})["recently_played"] = recently_played_data
-                if top_tracks_data: user_contexts.setdefault(user_id, {}).setdefault("spotify", {})["top_tracks"] = top_tracks_data
-        asyncio.create_task(_fetch_spotify_data())
+                if recently_played_data:
+                    spotify_ctx["recently_played"] = recently_played_data
+                    spotify_ctx["_artist_summary"] = _summarize_recent_artists(recently_played_data)
+                    user_ctx["_summary_dirty"] = True
+                if top_tracks_data:
+                    spotify_ctx["top_tracks"] = top_tracks_data
+                    user_ctx["_summary_dirty"] = True
+        # The refresh used to be fire-and-forget, so the analysis below always
+        # ran on stale Spotify data and only the *next* /recommend saw the
+        # update. Awaiting here costs nothing extra - both fetches inside run
+        # concurrently - and feeds the analysis fresh tracks.
+        try:
+            await _fetch_spotify_data()
+        except Exception as e_refresh:
+            logger.warning(f"Spotify refresh failed for user {user_id}, analyzing with cached data: {e_refresh}")
         
-        # Analyze existing context (mood, preferences, history, existing Spotify data)
-        analysis_results = await analyze_conversation(user_id)
+        # Skip the analysis entirely when nothing moved: mood explicitly set,
+        # no new history/Spotify data since the last run, and the explicit
+        # settings that feed the prompt are unchanged.
+        analysis_sig = (user_ctx.get("mood"), tuple(user_ctx.get("preferences") or ()))
+        last_analysis = user_ctx.get("_last_analysis")
+        if (user_ctx.get("mood") and last_analysis is not None
+                and not user_ctx.get("_summary_dirty")
+                and user_ctx.get("_last_analysis_sig") == analysis_sig):
+            analysis_results = last_analysis
+            logger.info(f"Reusing last analysis for user {user_id} (no new data).")
+        else:
+            # Analyze existing context (mood, preferences, history, existing Spotify data)
+            analysis_results = await analyze_conversation(user_id)
+            user_ctx["_last_analysis"] = analysis_results
+            user_ctx["_last_analysis_sig"] = analysis_sig
         current_mood = analysis_results.get("mood")
         
         # If mood is not set or neutral, prompt the user to set it via the /mood conversation.
@@ -1855,16 +2657,25 @@ async def smart_recommend_music(update: Update, context: ContextTypes.DEFAULT_TY
         seed_track_ids, seed_artist_ids, seed_genre_list = [], [], analysis_results.get("genres", [])
         ai_inferred_artists = analysis_results.get("artists", []) # Artists inferred by AI
 
-        spotify_user_ctx_data = user_contexts.get(user_id, {}).get("spotify", {})
+        spotify_user_ctx_data = spotify_ctx
         
         # Prioritize seeds: 1. Explicitly liked artists (if any match recent/top on Spotify for ID), 2. Recent tracks, 3. Top artists (not yet explicitly used here but could be).
         # Use AI inferred artists as seed if available and Spotify linked.
         spotify_client_token_for_general_api = await get_spotify_token()
 
         if ai_inferred_artists and spotify_client_token_for_general_api:
-            for art_name in ai_inferred_artists:
-                # Try to get Spotify ID for AI inferred artist name
-                artist_search_result = await search_spotify_track(spotify_client_token_for_general_api, f"artist:{art_name}") # Search for artist type explicitly
+            # Resolve all inferred artist names concurrently - the searches are
+            # independent and share the pooled HTTP session, so they overlap
+            # instead of paying one round-trip each in sequence.
+            artist_lookups = await asyncio.gather(
+                *(search_spotify_track(spotify_client_token_for_general_api, f"artist:{art_name}") # Search for artist type explicitly
+                  for art_name in ai_inferred_artists),
+                return_exceptions=True # One failed seed must not kill the batch
+            )
+            for artist_search_result in artist_lookups:
+                if isinstance(artist_search_result, BaseException):
+                    logger.debug(f"Seed artist lookup failed (user {user_id}): {artist_search_result}")
+                    continue
                 if artist_search_result and artist_search_result.get("artists") and artist_search_result["artists"][0].get("id"):
                      seed_artist_ids.append(artist_search_result["artists"][0]["id"])
                 if len(seed_artist_ids) >= 2: break # Max 2 artist seeds
@@ -1920,13 +2731,13 @@ async def smart_recommend_music(update: Update, context: ContextTypes.DEFAULT_TY
         logger.info(f"YouTube fallback recommendation search (user {user_id}) with query: '{youtube_search_query}'")
         await status_msg.edit_text(f"Searching YouTube for <b>{current_mood}</b> tracks matching '<i>{youtube_search_query[:50]}...</i>'", parse_mode=ParseMode.HTML)
 
-        yt_results = await asyncio.to_thread(search_youtube_sync, youtube_search_query, max_results=5)
+        yt_results = await search_youtube(youtube_search_query, max_results=5)
         if yt_results:
             resp_html_yt = f"🎵 Here are some YouTube suggestions for your <b>{current_mood}</b> mood, {user_name}:\n\n"
             kb_yt_recs = []
             valid_yt_count = 0
             for res in yt_results:
-                if not res.get('id') or not re.match(r'^[0-9A-Za-z_-]{11}$', res['id']): continue # Skip invalid
+                if not res.get('id') or not _YT_ID_EXACT_RE.match(res['id']): continue # Skip invalid
                 valid_yt_count +=1
                 
                 dur = res.get('duration', 0)
@@ -1995,21 +2806,24 @@ def cleanup_downloads_atexit() -> None:
     cleaned_count = 0
     try:
         if os.path.exists(DOWNLOAD_DIR):
-            for item_name in os.listdir(DOWNLOAD_DIR):
-                item_path = os.path.join(DOWNLOAD_DIR, item_name)
-                try:
-                    # Be more specific: target files generated by this bot
-                    # (e.g., common audio extensions, or specific filename patterns like voice_ or videoID_)
-                    is_temp_audio = item_path.endswith((".m4a", ".mp3", ".webm", ".ogg", ".opus", ".aac"))
-                    is_temp_voice = "voice_" in item_name and item_path.endswith(".ogg")
-                    is_temp_ytdl = re.match(r"^[a-zA-Z0-9_-]{11}_\d{14}\..+", item_name) # Matches videoID_timestamp.ext
-
-                    if os.path.isfile(item_path) and (is_temp_audio or is_temp_voice or is_temp_ytdl):
-                        os.remove(item_path)
-                        cleaned_count +=1
-                        logger.debug(f"Cleaned temp file: {item_path}")
-                except Exception as e_file_remove:
-                    logger.error(f"Failed to remove temporary file {item_path} during cleanup: {e_file_remove}")
+            # scandir carries file-type info in the dirent, so matching names
+            # are checked before any per-entry stat and non-files cost nothing.
+            with os.scandir(DOWNLOAD_DIR) as dir_iter:
+                for entry in dir_iter:
+                    item_name = entry.name
+                    try:
+                        # Be more specific: target files generated by this bot
+                        # (e.g., common audio extensions, or specific filename patterns like voice_ or videoID_)
+                        is_temp_audio = item_name.endswith(_TEMP_AUDIO_EXTS)
+                        is_temp_voice = "voice_" in item_name and item_name.endswith(".ogg")
+                        is_temp_ytdl = _YT_TEMP_RE.match(item_name) # Matches videoID_timestamp.ext
+
+                        if (is_temp_audio or is_temp_voice or is_temp_ytdl) and entry.is_file(follow_symlinks=False):
+                            os.unlink(entry.path)
+                            cleaned_count +=1
+                            logger.debug(f"Cleaned temp file: {entry.path}")
+                    except Exception as e_file_remove:
+                        logger.error(f"Failed to remove temporary file {entry.path} during cleanup: {e_file_remove}")
             if cleaned_count > 0:
                 logger.info(f"Successfully cleaned {cleaned_count} temporary file(s) from '{DOWNLOAD_DIR}'.")
             else:
@@ -2029,6 +2843,35 @@ def signal_exit_handler(sig, frame) -> None:
         cleanup_downloads_atexit() # Attempt cleanup now
     sys.exit(0) # This will trigger other atexit registered functions too.
 
+# Declarative command table: one MessageHandler consults this dict instead of
+# PTB iterating a dozen CommandHandler instances per update. Conversation
+# entry points (/link_spotify, /mood, /cancel, in-conversation /spotify_code)
+# stay on their ConversationHandlers and are registered ahead of the dispatch.
+COMMAND_TABLE = {
+    "/start": start,
+    "/help": help_command,
+    "/download": download_music,
+    "/search": search_command,
+    "/autodownload": auto_download_command,
+    "/lyrics": get_lyrics_command,
+    "/recommend": smart_recommend_music,
+    "/create_playlist": create_playlist,
+    "/clear": clear_history,
+    "/spotify_code": spotify_code_command,
+}
+
+async def dispatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Route a /command to its handler with one dict lookup."""
+    message = update.message
+    if not message or not message.text:
+        return
+    parts = message.text.split()
+    cmd = parts[0].split("@", 1)[0].lower()
+    handler = COMMAND_TABLE.get(cmd)
+    if handler is not None:
+        context.args = parts[1:]  # CommandHandler would have provided these
+        await handler(update, context)
+
 def main() -> None:
     """Start the bot."""
     # Configure bot application with increased timeouts and rate limiting
@@ -2040,24 +2883,10 @@ def main() -> None:
         .write_timeout(60.0)    
         .pool_timeout(180.0)    
         .rate_limiter(AIORateLimiter(overall_max_rate=20, max_retries=3)) # Default PTB overall is 30. Max retries is good.
+        .post_shutdown(close_http_session) # Release the pooled HTTP session
         .build()
     )
 
-    # --- Command Handlers ---
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("download", download_music))
-    application.add_handler(CommandHandler("search", search_command))
-    application.add_handler(CommandHandler("autodownload", auto_download_command))
-    application.add_handler(CommandHandler("lyrics", get_lyrics_command))
-    application.add_handler(CommandHandler("recommend", smart_recommend_music)) # Smart recommendations
-    application.add_handler(CommandHandler("create_playlist", create_playlist))
-    application.add_handler(CommandHandler("clear", clear_history))
-    # Global /spotify_code handler (if called outside conversation or as alternative entry)
-    # Note: spotify_code_handler itself determines state transitions
-    application.add_handler(CommandHandler("spotify_code", spotify_code_command))
-
-
     # --- Conversation Handlers ---
     # Spotify Linking Conversation
     spotify_conv_handler = ConversationHandler(
@@ -2093,6 +2922,10 @@ def main() -> None:
     application.add_handler(mood_conv_handler)
 
     # --- Message and Callback Handlers (Order can be important) ---
+    # Single table-driven dispatcher for plain commands. Registered after the
+    # conversation handlers so their command entry points keep priority.
+    application.add_handler(MessageHandler(filters.COMMAND, dispatch_command))
+
     application.add_handler(MessageHandler(filters.VOICE & ~filters.COMMAND, handle_voice))
     
     # General CallbackQueryHandler for other buttons (download, search options, etc.)
@@ -2114,7 +2947,22 @@ def main() -> None:
     logger.info("🚀 Starting MelodyMind Bot... Attempting to connect to Telegram.")
     try:
         # Run the bot until an interrupt
-        application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+        # Only message and callback_query updates are handled, so only those
+        # are requested - smaller payloads either way. With WEBHOOK_URL set,
+        # Telegram pushes updates instead of the bot paying one long-poll RTT
+        # per idle cycle; without it, polling keeps working for dev setups.
+        wanted_updates = ["message", "callback_query"]
+        if WEBHOOK_URL:
+            application.run_webhook(
+                listen="0.0.0.0",
+                port=WEBHOOK_PORT,
+                url_path=TOKEN,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{TOKEN}",
+                allowed_updates=wanted_updates,
+                drop_pending_updates=True,
+            )
+        else:
+            application.run_polling(allowed_updates=wanted_updates, drop_pending_updates=True)
     except TimedOut:
         logger.critical("Bot timed out connecting to Telegram. Check network or token.", exc_info=True)
     except NetworkError as ne:
@@ -2125,23 +2973,41 @@ def main() -> None:
         logger.info(" MelodyMind Bot has shut down.")
 
 
-if __name__ == "__main__":
+# Redirect URIs that mean "not really configured" - membership beats an
+# ever-growing or-chain as placeholders accumulate.
+_PLACEHOLDER_REDIRECTS = frozenset({"https://your-callback-url.com", "http://localhost", ""})
+
+# Startup configuration checks as a declarative (predicate, message) table:
+# the literals live in module constants instead of being rebuilt inside an
+# if-ladder, and adding a check is a row, not a branch.
+_STARTUP_CHECKS = (
+    (lambda: not OPENAI_API_KEY,
+     "WARNING: OPENAI_API_KEY not set. AI-powered features (chat, music request detection, mood analysis) will be disabled or degraded."),
+    (lambda: not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET,
+     "WARNING: SPOTIFY_CLIENT_ID or SPOTIFY_CLIENT_SECRET not set. Spotify general search/recommendation features may be limited. User-specific Spotify features require these AND linking."),
+    (lambda: not GENIUS_ACCESS_TOKEN,
+     "WARNING: GENIUS_ACCESS_TOKEN not set. Lyrics functionality will be disabled."),
+    (lambda: GENIUS_ACCESS_TOKEN and not _HAS_LYRICSGENIUS,
+     "WARNING: lyricsgenius library not found/imported, but GENIUS_ACCESS_TOKEN is set. Lyrics functionality will be disabled. Install with 'pip install lyricsgenius'."),
+    (lambda: SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET and SPOTIFY_REDIRECT_URI in _PLACEHOLDER_REDIRECTS,
+     "WARNING: SPOTIFY_REDIRECT_URI is set to the default placeholder 'https://your-callback-url.com'. "
+     "Spotify user linking (/link_spotify) will require manual code copying from the URL. "
+     "For a smoother experience, set a proper redirect URI in your .env and Spotify Developer Dashboard."),
+)
+
+def _validate_or_exit() -> None:
+    """Fail fast on must-have configuration before any soft warnings run."""
     if not TOKEN:
-        logger.critical("FATAL: TELEGRAM_TOKEN is not set in the environment. Bot cannot start.")
-        sys.exit(1)
-    if not OPENAI_API_KEY:
-        logger.warning("WARNING: OPENAI_API_KEY not set. AI-powered features (chat, music request detection, mood analysis) will be disabled or degraded.")
-    if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
-        logger.warning("WARNING: SPOTIFY_CLIENT_ID or SPOTIFY_CLIENT_SECRET not set. Spotify general search/recommendation features may be limited. User-specific Spotify features require these AND linking.")
-    if not GENIUS_ACCESS_TOKEN:
-        logger.warning("WARNING: GENIUS_ACCESS_TOKEN not set. Lyrics functionality will be disabled.")
-    else:
-        if not lyricsgenius: # Check if library failed to import
-            logger.warning("WARNING: lyricsgenius library not found/imported, but GENIUS_ACCESS_TOKEN is set. Lyrics functionality will be disabled. Install with 'pip install lyricsgenius'.")
-    
-    if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET and SPOTIFY_REDIRECT_URI == "https://your-callback-url.com":
-        logger.warning("WARNING: SPOTIFY_REDIRECT_URI is set to the default placeholder 'https://your-callback-url.com'. "
-                       "Spotify user linking (/link_spotify) will require manual code copying from the URL. "
-                       "For a smoother experience, set a proper redirect URI in your .env and Spotify Developer Dashboard.")
+        logger.critical(
+            "FATAL: TELEGRAM_TOKEN is not set. Expected a bot token string from "
+            "@BotFather in the TELEGRAM_TOKEN environment variable (or .env). "
+            "Bot cannot start.")
+        sys.exit(2)
+
+if __name__ == "__main__":
+    _validate_or_exit()
+    for _check_failed, _check_msg in _STARTUP_CHECKS:
+        if _check_failed():
+            logger.warning(_check_msg)
 
     main()